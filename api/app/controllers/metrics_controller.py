@@ -0,0 +1,22 @@
+from fastapi import Depends
+from app.controllers.base_controller import BaseController
+from app.services.cpu_executor import CpuExecutor
+
+class MetricsController(BaseController):
+    prefix = "metrics"
+
+    def __init__(self):
+        super().__init__()
+
+        self.router.add_api_route(
+            "/cpu",
+            self.cpu,
+            methods=["GET"],
+            dependencies=[Depends(self.set_current_user)]
+        )
+
+    async def cpu(self):
+        """
+        Ocupação do executor de CPU da API e latências (ms) de cada operação
+        """
+        return CpuExecutor.shared().metrics()
@@ -1,14 +1,15 @@
 from app.models.photo import Photo
 from app.models.face import Face
 from app.controllers.view_controller import ViewController
-from PIL import Image
-from io import BytesIO
-from fastapi import HTTPException,Depends,Query
-from fastapi.responses import StreamingResponse
-from pathlib import Path
-import os,json
+from fastapi import HTTPException,Depends,Query,Request
+from app.services.renditions import Renditions
+from app.services.rendition_cache import RenditionCache
+import os,json,mimetypes,asyncio
 from app.utils import logger_info,logger_error,execute_raw_sql
 
+# Recortes identificados pelo id da face nunca mudam de conteúdo
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
 class PhotoController(ViewController):
     model = Photo
     prefix = "photos"
@@ -21,6 +22,12 @@ class PhotoController(ViewController):
         self.router.add_api_route("/thumbnail/{id}", self.get_thumbnail, methods=["GET"])
         self.router.add_api_route("/scaled/{id}", self.get_scaled, methods=["GET"])
         self.router.add_api_route("/face-thumbnail/{face_id}", self.get_face_thumbnail, methods=["GET"])
+        self.router.add_api_route(
+            "/original/{id}",
+            self.get_original,
+            methods=["GET"],
+            dependencies=[Depends(self.set_current_user)]
+        )
         self.router.add_api_route(
             "/by-owner/{owner_type}/{owner_id}", 
             self.get_by_owner, 
@@ -66,18 +73,19 @@ class PhotoController(ViewController):
                 filter_search = f" AND photos.{self.search_field} LIKE '%%{search}%%'"
             
             if(owner_type=='search'):
+                # Fotos ordenadas pela face mais semelhante de cada uma
                 raw_query = f"""
                     SELECT photos.* FROM photos
+                    INNER JOIN (
+                        SELECT search_faces.photo_id, MAX(search_faces.similarity) AS similarity
+                        FROM search_faces
+                        WHERE search_faces.search_id = {owner_id}
+                        GROUP BY search_faces.photo_id
+                    ) AS ranked ON ranked.photo_id = photos.id
                     WHERE
-                        photos.user_id = {self.current_user.id} AND
-                        EXISTS (
-                            SELECT 1
-                            FROM search_faces
-                            WHERE 
-                                search_faces.photo_id = photos.id AND 
-                                search_faces.search_id = {owner_id}
-                        )
+                        photos.user_id = {self.current_user.id}
                         {filter_search}
+                    ORDER BY ranked.similarity DESC, photos.id
                 """
             elif(owner_type=='collection'):
                 raw_query = f"""
@@ -109,7 +117,12 @@ class PhotoController(ViewController):
             if(search_id):
                 query = f"""
                     SELECT 
-                        faces.*,
+                        faces.id,
+                        faces.data,
+                        faces.user_id,
+                        faces.photo_id,
+                        faces.created_at,
+                        faces.updated_at,
                         search_faces.similarity 
                     FROM faces
                     INNER JOIN search_faces ON search_faces.face_id = faces.id
@@ -122,21 +135,24 @@ class PhotoController(ViewController):
                 result = await execute_raw_sql(query)
                 result = [{**item,'data': json.loads(item['data'])} for item in result]
             else:
-                result = await Face.filter(photo_id=photo_id).all()
+                # O embedding binário não é retornado para o cliente
+                result = await Face.filter(photo_id=photo_id).values(
+                    'id', 'data', 'user_id', 'photo_id', 'created_at', 'updated_at'
+                )
                
             return result
         except Exception as e:
             logger_error(__name__,e)
             raise HTTPException(status_code=400, detail=str(e))
     
-    async def get_face_thumbnail(self, face_id: int):
+    async def get_face_thumbnail(self, face_id: int, request: Request):
         """
         Retorna uma versão miniatura da face
 
         Args:
             face_id (int): Id da face
         Returns:
-            StreamingResponse: Miniatura da face
+            Response: Miniatura da face
         """
         try:
             face = await Face.get_or_none(id=face_id)
@@ -146,85 +162,85 @@ class PhotoController(ViewController):
             face_path = await face.get_face_path()
             if not os.path.exists(face_path):
                 raise HTTPException(status_code=404, detail="Miniatura da face não encontrada")
-            
-            with open(face_path, "rb") as f:
-                return StreamingResponse(BytesIO(f.read()), media_type="image/jpeg")
+
+            # O recorte de uma face nunca muda (uma nova indexação cria novas faces)
+            media_type = mimetypes.guess_type(face_path)[0] or "image/jpeg"
+            return await self.file_response(request, face_path, media_type, IMMUTABLE_CACHE_CONTROL)
+        except HTTPException:
+            raise
         except Exception as e:
             logger_error(__name__,e)
             raise HTTPException(status_code=400, detail=str(e))
 
-    async def get_thumbnail(self, id: int):
+    async def get_rendition(self, id: int, name: str, request: Request):
         """
-        Retorna uma versão miniatura da imagem
+        Retorna uma versão reduzida da foto, gerada na indexação ou, se ausente, pelo cache de versões
 
         Args:
             id (int): Id do arquivo
+            name (str): Nome da versão (ver `Renditions.sizes`)
         Returns:
-            StreamingResponse: Miniatura da imagem
+            Response: Versão reduzida da foto
         """
         try:
             file = await self.model.get_or_none(id=id)
             if not file:
                 raise HTTPException(status_code=404, detail="Arquivo não encontrado")
 
-            file_type, image_format = file.mime_type.split("/")
-            
-            # Definir o caminho da miniatura
-            original_path = Path(file.file_path)
-            thumb_dir = original_path.parent / "thumbs"
-            thumb_path = thumb_dir / f"{original_path.stem}_thumb.{original_path.suffix}"
-            
-            # Criar diretório de thumbs se não existir
-            thumb_dir.mkdir(exist_ok=True)
-            
-            # Se a miniatura já existir, retorná-la diretamente
-            if thumb_path.exists():
-                with open(thumb_path, "rb") as f:
-                    return StreamingResponse(BytesIO(f.read()), media_type=file.mime_type)
-            
-            # Se não existir, criar a miniatura
-            with Image.open(file.file_path) as img:
-                img.thumbnail((300, 300))  # Redimensiona mantendo o aspect ratio
-                
-                # Salvar no sistema de arquivos
-                img.save(thumb_path, format=image_format.upper(), optimize=True)
-                
-                # Também preparar para retornar
-                buffer = BytesIO()
-                img.save(buffer, format=image_format.upper(), optimize=True)
-                buffer.seek(0)
-
-            return StreamingResponse(buffer, media_type=file.mime_type)
-
+            rendition_path = Renditions.get_path(file.file_path, name)
+            version = None
+            if not os.path.exists(rendition_path):
+                rendition_path = await RenditionCache.get(file.id, file.file_path, name)
+                version = await asyncio.to_thread(RenditionCache.get_version, file.file_path, name)
+
+            # A versão muda com o formato, os tamanhos ou uma nova geração sem mudar a URL:
+            # o navegador revalida a cada uso (ETag/304)
+            return await self.file_response(request, rendition_path, Renditions.get_media_type(), version=version)
+        except HTTPException:
+            raise
         except Exception as e:
+            logger_error(__name__,e)
             raise HTTPException(status_code=400, detail=str(e))
+
+    async def get_thumbnail(self, id: int, request: Request):
+        """
+        Retorna uma versão miniatura da imagem
+
+        Args:
+            id (int): Id do arquivo
+        Returns:
+            Response: Miniatura da imagem
+        """
+        return await self.get_rendition(id, 'thumbnail', request)
     
-    async def get_scaled(self, id: int):
+    async def get_scaled(self, id: int, request: Request):
         """
         Retorna uma versão escalada da imagem
 
         Args:
             id (int): Id do arquivo
         Returns:
-            StreamingResponse: Imagem escalada
+            Response: Imagem escalada
         """
-        try:
-            file = await self.model.get_or_none(id=id)
-            file_type, image_format = file.mime_type.split("/")
+        return await self.get_rendition(id, 'scaled', request)
+
+    async def get_original(self, id: int, request: Request):
+        """
+        Download da foto original
 
+        Args:
+            id (int): Id do arquivo
+        Returns:
+            Response: Foto original
+        """
+        try:
+            file = await self.get_model_by_user().get_or_none(id=id)
             if not file:
                 raise HTTPException(status_code=404, detail="Arquivo não encontrado")
-            
-            # Limita o tamanho da imagem
-            with Image.open(file.file_path) as img:
-                img.thumbnail((1280, 1280))  # Redimensiona mantendo o aspect ratio
 
-                # Também preparar para retornar
-                buffer = BytesIO()
-                img.save(buffer, format=image_format.upper(), optimize=True)
-                buffer.seek(0)
-
-            return StreamingResponse(buffer, media_type=file.mime_type)
+            return await self.file_response(request, file.file_path, file.mime_type, filename=file.original_name)
+        except HTTPException:
+            raise
         except Exception as e:
+            logger_error(__name__,e)
             raise HTTPException(status_code=400, detail=str(e))
-    
\ No newline at end of file
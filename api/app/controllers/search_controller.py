@@ -1,4 +1,4 @@
-from app.models.search import Search,SearchStatus
+from app.models.search import Search,SearchStatus,SearchMode
 from app.models.search_face import SearchFace
 from .view_controller import ViewController
 from app.models.photo import Photo
@@ -10,8 +10,9 @@ from fastapi.responses import JSONResponse,StreamingResponse
 import json,os
 from app.utils import logger_info,logger_error,execute_raw_sql
 from app.services.recognition import Recognition
+from app.services.search_engine import SearchEngine
+from app.services.zip_stream import ZipStream
 from app.tasks import search_faces
-import zipfile,io
 
 class SearchController(ViewController):
     model = Search
@@ -42,6 +43,7 @@ class SearchController(ViewController):
         try:
             params_dict = json.loads(params)
             params_dict["user_id"] = self.current_user.id
+            self.validate_mode(params_dict)
 
             async with transactions.in_transaction():
                 # Criação do registro
@@ -50,8 +52,16 @@ class SearchController(ViewController):
                 photo = await self.process_uploaded_file(file, Photo, record)
 
             # Inicializa o FaceAnalysis uma única vez
-            recognition = await Recognition.create()
-            photo = await recognition.process_single_photo(photo)
+            try:
+                recognition = await Recognition.create()
+                photo = await recognition.process_single_photo(photo)
+            except HTTPException:
+                # Executor de CPU saturado: a pesquisa é descartada e o cliente tenta novamente
+                if os.path.exists(photo.file_path):
+                    os.remove(photo.file_path)
+                await photo.delete()
+                await record.delete()
+                raise
 
             # Validação pós-processamento
             if not photo.face_count:
@@ -81,6 +91,9 @@ class SearchController(ViewController):
             logger_info(__name__, f"Job criado para processamento de pesquisa: {record.id}")
             return record
 
+        except HTTPException:
+            raise
+
         except json.JSONDecodeError as e:
             logger_error(__name__, e)
             raise HTTPException(400, str(e))
@@ -89,6 +102,15 @@ class SearchController(ViewController):
             logger_error(__name__, e)
             raise HTTPException(400, str(e))
     
+    def validate_mode(self, params: dict):
+        """
+        Valida o modo da pesquisa: por tolerância ou as K faces mais semelhantes
+        """
+        if params.get('mode', SearchMode.THRESHOLD) not in (SearchMode.THRESHOLD, SearchMode.TOP_K):
+            raise HTTPException(400, "Modo de pesquisa inválido!")
+        if params.get('mode') == SearchMode.TOP_K and int(params.get('top_k') or 0) < 1:
+            raise HTTPException(400, "Informe a quantidade de faces da pesquisa!")
+
     async def get_collections(
         self,
         page: int = Query(1, ge=1, description="Número da página"),
@@ -145,24 +167,33 @@ class SearchController(ViewController):
             Record: Registro atualizado
         """
         try:
+            self.validate_mode(params)
             async with transactions.in_transaction():
                 record = await self.get_model_by_user().get_or_none(id=id)
                 if not record:
                     raise HTTPException(status_code=404, detail="Registro não encontrado")
                 
-                if(params.get('force_recreate')):
+                force_recreate = params.get('force_recreate')
+                if force_recreate:
                     await SearchFace.filter(search_id=record.id).delete()
 
-                record.tolerance_level = params['tolerance_level']
+                record.tolerance_level = params.get('tolerance_level', record.tolerance_level)
+                record.mode = params.get('mode', record.mode)
+                record.top_k = params.get('top_k', record.top_k)
                 await record.save()
 
-                job = await Job.create(
-                    process_type="search_faces",
-                    owner_type='search',
-                    owner_id=record.id
-                )
+            # Com a pesquisa concluída, a nova tolerância (ou K) apenas filtra os resultados guardados
+            if not force_recreate and record.status == SearchStatus.FINISHED:
+                if await SearchEngine(record).retune() is not None:
+                    return record
+
+            job = await Job.create(
+                process_type="search_faces",
+                owner_type='search',
+                owner_id=record.id
+            )
 
-                search_faces.delay(job.id)
+            search_faces.delay(job.id)
                 
             return record
         except Exception as e:
@@ -171,39 +202,25 @@ class SearchController(ViewController):
     
     async def download_result(self, search_id: int):
         try:
-            # Cria um gerador de chunks para streaming
-            async def generate_zip_chunks():
-                zip_buffer = io.BytesIO()
-                raw_query = f"""
-                    SELECT photos.file_path, photos.original_name FROM photos
-                    WHERE
-                        photos.user_id = {self.current_user.id} AND
-                        EXISTS (
-                            SELECT 1
-                            FROM search_faces
-                            WHERE 
-                                search_faces.photo_id = photos.id AND 
-                                search_faces.search_id = {search_id}
-                        )
-                """
-                files_to_zip = await execute_raw_sql(raw_query)
-
-                with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED, False) as zip_file:
-                    for file_to_zip in files_to_zip:
-                        zip_file.write(file_to_zip['file_path'], arcname=file_to_zip['original_name'])
-
-                zip_buffer.seek(0)
-                
-                # Lê o ZIP em chunks de 1MB
-                while chunk := zip_buffer.read(1024 * 1024):
-                    yield chunk
-                    zip_buffer.flush()
-
-                zip_buffer.close()
+            raw_query = f"""
+                SELECT photos.file_path, photos.original_name FROM photos
+                WHERE
+                    photos.user_id = {self.current_user.id} AND
+                    EXISTS (
+                        SELECT 1
+                        FROM search_faces
+                        WHERE 
+                            search_faces.photo_id = photos.id AND 
+                            search_faces.search_id = {search_id}
+                    )
+                ORDER BY photos.id
+            """
+            files_to_zip = await execute_raw_sql(raw_query)
+            files = [(file_to_zip['file_path'], file_to_zip['original_name']) for file_to_zip in files_to_zip]
 
             # Configura o StreamingResponse com o gerador
             return StreamingResponse(
-                generate_zip_chunks(),
+                ZipStream.stream(files),
                 media_type="application/zip",
                 headers={
                     "Content-Disposition": "attachment; filename=download.zip"
@@ -24,6 +24,9 @@ class SSEController(BaseController):
         
         async def event_stream():
             async for event in sse_manager.get_event_generator(session.user_id):
+                # Eventos nomeados (ex.: progress) não disparam o onmessage genérico do cliente
+                if event.get('event'):
+                    yield f"event: {event['event']}\n"
                 yield f"data: {json.dumps(event)}\n\n"
 
         return StreamingResponse(
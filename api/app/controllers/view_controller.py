@@ -1,6 +1,9 @@
-from fastapi import HTTPException, Depends, UploadFile,Query
-from fastapi.responses import JSONResponse
-from app.utils import logger_info,logger_error,execute_raw_sql
+from fastapi import HTTPException, Depends, UploadFile,Query,Request
+from fastapi.responses import JSONResponse,Response,FileResponse,StreamingResponse
+from email.utils import formatdate,parsedate_to_datetime
+from urllib.parse import quote
+import asyncio
+from app.utils import logger_info,logger_error,execute_raw_sql,copy_with_hash
 from typing import Any
 import os
 from tortoise import transactions
@@ -167,6 +170,126 @@ class ViewController(BaseController):
             logger_error(__name__,e)
             raise HTTPException(400, str(e))
     
+    async def file_response(
+        self,
+        request: Request,
+        file_path: str,
+        media_type: str,
+        cache_control: str = "private, no-cache",
+        filename: str = None,
+        version: tuple = None
+    ):
+        """
+        Envia um arquivo do disco sem carregá-lo na memória, com validadores (ETag forte e
+        Last-Modified), resposta 304 para requisições condicionais e suporte a Range
+
+        Args:
+            request (Request): Requisição (cabeçalhos condicionais e Range)
+            file_path (str): Caminho do arquivo
+            media_type (str): Tipo do conteúdo
+            cache_control (str): Política de cache do navegador
+            filename (str, optional): Nome para download (Content-Disposition: attachment)
+            version (tuple, optional): (ETag, data de modificação) do conteúdo, quando a data do arquivo não o identifica
+        Returns:
+            Response: 200, 206 ou 304
+        """
+        try:
+            stat = await asyncio.to_thread(os.stat, file_path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+
+        # Os arquivos são sempre substituídos por inteiro, então tamanho e data identificam o conteúdo
+        etag, mtime = version or (f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"', stat.st_mtime)
+        headers = {
+            "ETag": etag,
+            "Last-Modified": formatdate(mtime, usegmt=True),
+            "Cache-Control": cache_control,
+            "Accept-Ranges": "bytes",
+        }
+
+        if self.is_not_modified(request, etag, mtime):
+            return Response(status_code=304, headers=headers)
+
+        if filename:
+            headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{quote(filename)}"
+
+        byte_range = self.parse_range(request, etag, stat.st_size)
+        if byte_range is None:
+            return FileResponse(file_path, media_type=media_type, headers=headers, stat_result=stat)
+
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            self.read_file_range(file_path, start, end),
+            status_code=206,
+            media_type=media_type,
+            headers=headers
+        )
+
+    @staticmethod
+    def is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+        """
+        Verifica os cabeçalhos If-None-Match (prioritário) e If-Modified-Since
+        """
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags
+
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    @staticmethod
+    def parse_range(request: Request, etag: str, size: int):
+        """
+        Interpreta um cabeçalho Range de intervalo único (bytes=início-fim, início- ou -sufixo)
+
+        Returns:
+            tuple: (início, fim) inclusivos, ou None para enviar o arquivo inteiro
+        """
+        range_header = request.headers.get("range")
+        if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+            return None
+
+        # Com If-Range o intervalo só vale se o arquivo não mudou
+        if_range = request.headers.get("if-range")
+        if if_range and if_range.strip() != etag:
+            return None
+
+        try:
+            start, end = range_header[len("bytes="):].strip().split("-", 1)
+            if start:
+                start, end = int(start), min(int(end), size - 1) if end else size - 1
+            else:
+                start, end = max(size - int(end), 0), size - 1
+        except ValueError:
+            return None
+
+        if start >= size or start > end:
+            raise HTTPException(status_code=416, detail="Intervalo inválido", headers={"Content-Range": f"bytes */{size}"})
+        return start, end
+
+    @staticmethod
+    def read_file_range(file_path: str, start: int, end: int, chunk_size: int = 64 * 1024):
+        """
+        Lê um intervalo do arquivo em blocos (executado fora do loop de eventos pelo StreamingResponse)
+        """
+        with open(file_path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
     async def process_uploaded_file(self, file: UploadFile,file_model: Any, owner: Any):
         """
         Processa o arquivo e retorna o registro do arquivo processado
@@ -185,9 +308,13 @@ class ViewController(BaseController):
                 directory = os.path.dirname(file_record.file_path)
                 os.makedirs(directory, exist_ok=True)
 
-                # Salva o arquivo na pasta local
+                # Salva o arquivo na pasta local calculando o hash do conteúdo
                 with open(file_record.file_path, "wb") as buffer:
-                    shutil.copyfileobj(file.file, buffer)
+                    content_hash = copy_with_hash(file.file, buffer)
+
+                if 'content_hash' in file_model._meta.fields_map:
+                    file_record.content_hash = content_hash
+                    await file_record.save(update_fields=['content_hash'])
                 
             return file_record
         except Exception as e:
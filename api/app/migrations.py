@@ -0,0 +1,90 @@
+import json
+from tortoise import transactions
+from app.utils import logger_info, logger_error, execute_raw_sql
+
+# Alterações de esquema idempotentes executadas na inicialização da API.
+# O generate_schemas do Tortoise só cria tabelas inexistentes, então colunas e índices
+# novos em tabelas já existentes precisam ser aplicados aqui.
+SCHEMA_MIGRATIONS = [
+    "ALTER TABLE faces ADD COLUMN IF NOT EXISTS embedding BYTEA",
+    "ALTER TABLE jobs ADD COLUMN IF NOT EXISTS progress JSONB",
+    "ALTER TABLE photos ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "ALTER TABLE photos ADD COLUMN IF NOT EXISTS model_version VARCHAR(100)",
+    "CREATE INDEX IF NOT EXISTS photos_content_hash_idx ON photos (content_hash, model_version) WHERE is_indexed",
+    "ALTER TABLE searches ADD COLUMN IF NOT EXISTS mode VARCHAR(20) NOT NULL DEFAULT 'threshold'",
+    "ALTER TABLE searches ADD COLUMN IF NOT EXISTS top_k INT NOT NULL DEFAULT 100",
+    "CREATE INDEX IF NOT EXISTS search_faces_similarity_idx ON search_faces (search_id, similarity DESC)",
+    # Unicidade (search_id, face_id) em bancos criados antes da restrição: remove os vínculos duplicados antes de criá-la
+    """
+    DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = 'search_faces'::regclass AND contype = 'u')
+           AND NOT EXISTS (SELECT 1 FROM pg_indexes WHERE tablename = 'search_faces' AND indexname = 'search_faces_search_face_uniq') THEN
+            DELETE FROM search_faces duplicated USING search_faces kept
+            WHERE duplicated.search_id = kept.search_id AND duplicated.face_id = kept.face_id AND duplicated.id > kept.id;
+            CREATE UNIQUE INDEX search_faces_search_face_uniq ON search_faces (search_id, face_id);
+        END IF;
+    END $$
+    """,
+]
+
+async def run_migrations():
+    """
+    Aplica as alterações de esquema pendentes
+    """
+    try:
+        for raw_sql in SCHEMA_MIGRATIONS:
+            await execute_raw_sql(raw_sql, has_result=False)
+    except Exception as e:
+        logger_error(__name__, e)
+        raise
+
+async def migrate_face_embeddings(batch_size: int = 1000) -> int:
+    """
+    Converte os embeddings gravados em JSON (faces.data) para a coluna binária faces.embedding
+
+    Args:
+        batch_size (int): Quantidade de faces convertidas por transação
+    Returns:
+        int: Quantidade de faces convertidas
+    """
+    from app.services.embedding import encode_embedding
+
+    try:
+        converted = 0
+        last_id = 0
+        while True:
+            rows = await execute_raw_sql(f"""
+                SELECT faces.id, faces.data->'embedding' AS embedding FROM faces
+                WHERE
+                    faces.id > {last_id} AND
+                    faces.embedding IS NULL AND
+                    faces.data ? 'embedding'
+                ORDER BY faces.id
+                LIMIT {batch_size}
+            """)
+
+            if not rows:
+                break
+
+            values = []
+            for row in rows:
+                embedding = row['embedding']
+                if isinstance(embedding, str):
+                    embedding = json.loads(embedding)
+                values.append([encode_embedding(embedding) if embedding else None, row['id']])
+
+            async with transactions.in_transaction() as conn:
+                await conn.execute_many(
+                    "UPDATE faces SET embedding = $1, data = data - 'embedding' WHERE id = $2",
+                    values
+                )
+
+            converted += len(rows)
+            last_id = rows[-1]['id']
+
+        if converted:
+            logger_info(__name__, f'{converted} embedding(s) convertido(s) para o formato binário')
+        return converted
+    except Exception as e:
+        logger_error(__name__, e)
+        raise
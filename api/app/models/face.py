@@ -5,6 +5,7 @@ from pathlib import Path
 
 class Face(BaseModel):
     data = fields.JSONField()
+    embedding = fields.BinaryField(null=True)  # Embedding normalizado em bytes (ver app.services.embedding)
     user = fields.ForeignKeyField('models.User', related_name='faces')
     photo = fields.ForeignKeyField('models.Photo', related_name='faces')
 
@@ -14,15 +15,28 @@ class Face(BaseModel):
     def __str__(self):
         return self.id
     
-    async def get_face_path(self) -> str:
+    @staticmethod
+    def build_face_path(photo, face_id: int) -> str:
         """
-        Retorna o caminho da face
+        Monta o caminho do recorte de uma face a partir da foto, sem consultar o banco
 
+        Args:
+            photo (Photo): Foto de origem da face
+            face_id (int): Id da face
         Returns:
             str: O caminho da face
         """
-        photo = await self.photo
         original_path = Path(photo.file_path)
         face_dir = original_path.parent / "faces"
         
-        return str(f"{face_dir}/{self.id}{photo.extension_type}")
+        return str(f"{face_dir}/{face_id}{photo.extension_type}")
+
+    async def get_face_path(self) -> str:
+        """
+        Retorna o caminho da face
+
+        Returns:
+            str: O caminho da face
+        """
+        photo = await self.photo
+        return self.build_face_path(photo, self.id)
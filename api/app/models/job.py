@@ -10,6 +10,7 @@ class JobStatus:
 class Job(PolymorphicModel):
     status = fields.IntField(default=JobStatus.PENDING)
     process_type = fields.CharField(max_length=50)
+    progress = fields.JSONField(null=True)  # Último progresso publicado (ver app.services.progress)
 
     class Meta:
         table = "jobs"
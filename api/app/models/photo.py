@@ -6,9 +6,15 @@ import mimetypes
 from .base import FileModel
 
 class Photo(FileModel):
+    # Versão anterior de uma foto substituída por um novo envio da coleção. Ela continua disponível
+    # para o reaproveitamento da análise (AnalysisCache) e é removida ao fim da indexação
+    REPLACED_OWNER_TYPE = 'replaced'
+
     user = fields.ForeignKeyField('models.User', related_name='photos')
     face_count = fields.IntField(default=0)
     is_indexed = fields.BooleanField(default=False) 
+    content_hash = fields.CharField(max_length=64, null=True)  # SHA-256 do arquivo
+    model_version = fields.CharField(max_length=100, null=True)  # Modelo/perfil usado na indexação
 
     class Meta:
         table = "photos"
@@ -18,6 +24,16 @@ class Photo(FileModel):
         if os.path.exists(self.file_path):
             os.remove(self.file_path)
 
+        from app.services.renditions import Renditions
+        from app.services.rendition_cache import RenditionCache
+        Renditions.remove(self.file_path)
+        RenditionCache.remove(self.id)
+
+        # O índice da coleção deixa de ser válido sem as faces desta foto
+        if self.owner_type == 'collection':
+            from app.services.face_index import FaceIndex
+            FaceIndex.invalidate(self.owner_id)
+
         # Chama o delete original
         await super().delete(*args, **kwargs)
 
@@ -7,11 +7,17 @@ class SearchStatus:
     PROCESSING = 1
     FINISHED = 2
 
+class SearchMode:
+    THRESHOLD = 'threshold'  # Faces acima da tolerância
+    TOP_K = 'top_k'  # As K faces mais semelhantes
+
 class Search(BaseModel):
     user = fields.ForeignKeyField('models.User', related_name='searches')
     name = fields.CharField(max_length=500)
     thumbnail_photo = fields.ForeignKeyField('models.Photo', related_name='searches', null=True,on_delete=fields.SET_NULL)
     tolerance_level = fields.IntField(default=60)
+    mode = fields.CharField(max_length=20, default=SearchMode.THRESHOLD)
+    top_k = fields.IntField(default=100)
     status = fields.IntField(default=SearchStatus.WAITING)
     collections = fields.JSONField(default=[])
 
@@ -10,6 +10,7 @@ class SearchFace(BaseModel):
 
     class Meta:
         table = "search_faces"
+        unique_together = (("search", "face"),)
 
     def __str__(self):
         return f"{self.search_id} - {self.face_id}"
@@ -0,0 +1,89 @@
+import os
+import asyncio
+from app.models.face import Face
+from app.models.photo import Photo
+from app.utils import logger_error
+
+class AnalysisCache:
+    """
+    Reaproveitamento do resultado da análise de fotos com conteúdo idêntico.
+    As fotos já indexadas funcionam como cache: a chave é o hash SHA-256 do arquivo (calculado
+    durante o upload/extração) junto com a versão do modelo que gerou as faces. Uma foto
+    repetida (na mesma coleção, em outra coleção ou como foto de pesquisa) recebe uma cópia
+    das faces já gravadas em vez de passar novamente pela detecção e pelo embedding.
+    O reaproveitamento é restrito às fotos do mesmo usuário.
+    """
+    enabled = os.getenv("ANALYSIS_CACHE", "1") == "1"
+
+    @classmethod
+    async def lookup(cls, photos, model_version: str) -> dict:
+        """
+        Busca as faces já calculadas para as fotos informadas
+
+        Args:
+            photos (list): Fotos a serem indexadas
+            model_version (str): Versão do modelo usada na indexação
+        Returns:
+            dict: Faces no formato de `Recognition.analyze` por id da foto encontrada no cache
+        """
+        keys = {(photo.user_id, photo.content_hash) for photo in photos if getattr(photo, 'content_hash', None)}
+        if not cls.enabled or not keys:
+            return {}
+
+        try:
+            sources = await Photo.filter(
+                user_id__in=list({user_id for user_id, _ in keys}),
+                content_hash__in=list({content_hash for _, content_hash in keys}),
+                model_version=model_version,
+                is_indexed=True
+            ).exclude(id__in=[photo.id for photo in photos]).order_by('id')
+
+            # Uma única foto de origem por usuário e conteúdo
+            source_by_key = {}
+            for source in sources:
+                if (source.user_id, source.content_hash) in keys:
+                    source_by_key.setdefault((source.user_id, source.content_hash), source)
+            if not source_by_key:
+                return {}
+
+            sources_by_id = {source.id: source for source in source_by_key.values()}
+            faces_by_source = {source_id: [] for source_id in sources_by_id}
+            rows = await Face.filter(photo_id__in=list(sources_by_id)).order_by('id').values_list('id', 'photo_id', 'data', 'embedding')
+            for face_id, photo_id, data, embedding in rows:
+                face_path = Face.build_face_path(sources_by_id[photo_id], face_id)
+                faces_by_source[photo_id].append({"data": data, "embedding": embedding, "crop": face_path})
+
+            # Leitura dos recortes fora do loop de eventos; fontes com recortes ilegíveis são ignoradas
+            faces_by_source = await asyncio.to_thread(cls.read_crops, faces_by_source)
+
+            result = {}
+            for photo in photos:
+                source = source_by_key.get((photo.user_id, getattr(photo, 'content_hash', None)))
+                if source and source.id in faces_by_source:
+                    result[photo.id] = faces_by_source[source.id]
+            return result
+        except Exception as e:
+            # Sem cache as fotos são simplesmente analisadas
+            logger_error(__name__, e)
+            return {}
+
+    @staticmethod
+    def read_crops(faces_by_source: dict) -> dict:
+        """
+        Substitui o caminho do recorte de cada face pelo seu conteúdo
+
+        Returns:
+            dict: Faces por foto de origem, sem as fotos cujos recortes não puderam ser lidos
+        """
+        result = {}
+        for source_id, faces in faces_by_source.items():
+            try:
+                crops = []
+                for face in faces:
+                    with open(face["crop"], "rb") as f:
+                        crops.append(f.read())
+                result[source_id] = [{**face, "crop": crop} for face, crop in zip(faces, crops)]
+            except Exception as e:
+                # As fotos desta origem são analisadas normalmente
+                logger_error(__name__, e)
+        return result
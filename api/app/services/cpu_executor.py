@@ -0,0 +1,135 @@
+import os
+import time
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+from app.utils import logger_error
+
+class CpuExecutorSaturated(HTTPException):
+    """
+    Fila do executor cheia: respondida com 503 e o tempo sugerido para nova tentativa
+    """
+    def __init__(self, retry_after: int):
+        super().__init__(
+            status_code=503,
+            detail="Servidor ocupado, tente novamente em instantes",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+class CpuExecutor:
+    """
+    Executor limitado para o trabalho pesado de CPU da API (decodificação de imagens e inferência).
+    Mantém o loop de eventos livre para as demais requisições (incluindo o SSE), recusa novos
+    trabalhos com 503 quando a fila está cheia e registra a latência de cada operação.
+    PIL e ONNX Runtime liberam o GIL durante o processamento, então threads são suficientes.
+    """
+    workers = int(os.getenv("API_CPU_WORKERS", min(4, os.cpu_count() or 1)))
+    max_queue = int(os.getenv("API_CPU_QUEUE", 16))  # Trabalhos aguardando além dos que estão em execução
+    retry_after = int(os.getenv("API_CPU_RETRY_AFTER", 2))  # Segundos sugeridos ao cliente quando saturado
+    samples = 1024  # Latências guardadas por operação para os percentis
+    _shared = None
+
+    def __init__(self, workers: int = None, max_queue: int = None):
+        self.workers = max(1, workers or self.workers)
+        self.max_queue = max(0, max_queue if max_queue is not None else self.max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='cpu')
+        self.pending = 0
+        self.stats = {}
+
+    @classmethod
+    def shared(cls) -> 'CpuExecutor':
+        """
+        Retorna o executor do processo da API
+        """
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def check(self):
+        """
+        Recusa o trabalho quando todas as threads estão ocupadas e a fila está cheia
+        """
+        if self.pending >= self.workers + self.max_queue:
+            raise CpuExecutorSaturated(self.retry_after)
+
+    async def run(self, operation: str, function, *args):
+        """
+        Executa a função no executor, registrando a espera na fila e o tempo de execução
+
+        Args:
+            operation (str): Nome da operação nas métricas
+            function: Função síncrona
+        Returns:
+            Any: Resultado da função
+        """
+        stats = self.stats.setdefault(operation, {
+            'count': 0, 'errors': 0, 'rejected': 0,
+            'wait': deque(maxlen=self.samples), 'run': deque(maxlen=self.samples)
+        })
+        try:
+            self.check()
+        except CpuExecutorSaturated:
+            stats['rejected'] += 1
+            raise
+
+        def timed():
+            started_at = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                stats['run'].append(time.perf_counter() - started_at)
+
+        self.pending += 1
+        queued_at = time.perf_counter()
+        try:
+            future = self.executor.submit(lambda: (time.perf_counter() - queued_at, timed()))
+            wait, result = await asyncio.wrap_future(future)
+            stats['wait'].append(wait)
+            return result
+        except Exception as e:
+            stats['errors'] += 1
+            logger_error(__name__, e)
+            raise
+        finally:
+            self.pending -= 1
+            stats['count'] += 1
+
+    @staticmethod
+    def percentiles(samples) -> dict:
+        """
+        Média e percentis (ms) de uma lista de latências em segundos
+        """
+        values = sorted(samples)
+        if not values:
+            return {'avg': None, 'p50': None, 'p99': None, 'max': None}
+
+        def percentile(ratio):
+            return round(values[min(len(values) - 1, int(ratio * len(values)))] * 1000, 2)
+
+        return {
+            'avg': round(sum(values) / len(values) * 1000, 2),
+            'p50': percentile(0.5),
+            'p99': percentile(0.99),
+            'max': round(values[-1] * 1000, 2),
+        }
+
+    def metrics(self) -> dict:
+        """
+        Ocupação atual e latências (espera na fila e execução) de cada operação
+        """
+        return {
+            'workers': self.workers,
+            'max_queue': self.max_queue,
+            'pending': self.pending,
+            'operations': {
+                operation: {
+                    'count': stats['count'],
+                    'errors': stats['errors'],
+                    'rejected': stats['rejected'],
+                    'wait_ms': self.percentiles(stats['wait']),
+                    'run_ms': self.percentiles(stats['run']),
+                }
+                for operation, stats in self.stats.items()
+            }
+        }
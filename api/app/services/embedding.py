@@ -0,0 +1,76 @@
+import os
+import numpy as np
+
+EMBEDDING_SIZE = 512  # Dimensão dos embeddings do ArcFace
+
+# Tipo usado para gravar os novos embeddings no banco (float32 ou float16). Na leitura o tipo é
+# identificado pelo tamanho de cada valor, então embeddings gravados com outro tipo continuam válidos
+EMBEDDING_DTYPE = np.dtype(os.getenv("FACE_EMBEDDING_DTYPE", "float32"))
+EMBEDDING_DTYPES = {
+    EMBEDDING_SIZE * np.dtype(dtype).itemsize: np.dtype(dtype)
+    for dtype in (np.float32, np.float16)
+}
+
+if EMBEDDING_DTYPE not in EMBEDDING_DTYPES.values():
+    raise ValueError("A variável de ambiente FACE_EMBEDDING_DTYPE deve ser float32 ou float16.")
+
+def normalize(vectors) -> np.ndarray:
+    """
+    Normaliza os vetores (L2) para que o produto escalar seja a similaridade de cosseno
+
+    Args:
+        vectors: Vetor (1D) ou matriz (2D) de embeddings
+    Returns:
+        np.ndarray: Vetores normalizados em float32
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+def encode_embedding(vector) -> bytes:
+    """
+    Normaliza o embedding e o converte em bytes compactados para gravação
+    """
+    return normalize(vector).astype(EMBEDDING_DTYPE).tobytes()
+
+def get_embedding_dtype(buffer: bytes) -> np.dtype:
+    """
+    Identifica o tipo de um embedding gravado pelo seu tamanho em bytes
+
+    Raises:
+        ValueError: Tamanho que não corresponde a um embedding de EMBEDDING_SIZE dimensões
+    """
+    dtype = EMBEDDING_DTYPES.get(len(buffer))
+    if dtype is None:
+        raise ValueError(f"Embedding com {len(buffer)} bytes não corresponde a {EMBEDDING_SIZE} dimensões em float32 ou float16")
+    return dtype
+
+def decode_embedding(buffer: bytes) -> np.ndarray:
+    """
+    Lê um embedding gravado sem copiar os bytes (o array retornado é somente leitura)
+    """
+    return np.frombuffer(buffer, dtype=get_embedding_dtype(buffer))
+
+def decode_embeddings(buffers) -> np.ndarray:
+    """
+    Empilha vários embeddings gravados em uma matriz float32 contígua
+
+    Args:
+        buffers: Lista de embeddings em bytes
+    Returns:
+        np.ndarray: Matriz (n, EMBEDDING_SIZE) em float32
+    """
+    buffers = list(buffers)
+    if not buffers:
+        return np.empty((0, EMBEDDING_SIZE), dtype=np.float32)
+
+    sizes = {len(buffer) for buffer in buffers}
+    if len(sizes) == 1:
+        # Todos com o mesmo tipo: leitura direta dos bytes concatenados
+        dtype = get_embedding_dtype(buffers[0])
+        matrix = np.frombuffer(b"".join(buffers), dtype=dtype).reshape(len(buffers), EMBEDDING_SIZE)
+        return matrix.astype(np.float32, copy=False)
+
+    # Tipos misturados (FACE_EMBEDDING_DTYPE alterado depois de gravações anteriores)
+    return np.stack([decode_embedding(buffer) for buffer in buffers]).astype(np.float32, copy=False)
@@ -0,0 +1,323 @@
+import os
+import json
+import time
+import shutil
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Optional
+from app.utils import logger_info, logger_error
+
+class FaceIndex:
+    """
+    Índice aproximado (IVF-flat) dos embeddings de uma coleção, gravado em disco junto às fotos.
+    Os embeddings são agrupados em listas pelo centróide mais próximo (k-means esférico) e a busca
+    compara a referência apenas com as listas dos `nprobe` centróides mais semelhantes.
+
+    Os arquivos são mapeados em memória (somente leitura): todos os processos de pesquisa da máquina
+    compartilham as mesmas páginas do cache do sistema em vez de carregar os embeddings do banco.
+    Cada processo mantém os índices mapeados mais recentes até o limite de `cache_size`.
+    """
+    root = '/app/files/collection'
+    nprobe = int(os.getenv("FACE_INDEX_NPROBE", 16))
+    min_faces = int(os.getenv("FACE_INDEX_MIN_FACES", 1000))  # Abaixo disso o índice usa uma única lista (busca exata)
+    cache_size = int(os.getenv("FACE_INDEX_CACHE_MB", 1024)) * 1024 * 1024  # Memória dos índices mapeados por processo
+    train_sample = 64  # Amostras de treino por centróide
+    train_iterations = 10
+    chunk_size = 65536
+    files = ('centroids', 'offsets', 'vectors', 'face_ids', 'photo_ids')
+
+    _cache = OrderedDict()  # id da coleção -> (versão dos arquivos, índice), do menos para o mais recente
+    _cache_lock = threading.Lock()
+
+    def __init__(self, centroids, offsets, vectors, face_ids, photo_ids, trained_size: int):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.vectors = vectors
+        self.face_ids = face_ids
+        self.photo_ids = photo_ids
+        self.trained_size = trained_size
+
+    @property
+    def size(self) -> int:
+        return len(self.face_ids)
+
+    @property
+    def max_face_id(self) -> int:
+        return int(self.face_ids.max()) if self.size else 0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in self.files)
+
+    @classmethod
+    def get_path(cls, collection_id: int) -> str:
+        return f"{cls.root}/{collection_id}/index"
+
+    @classmethod
+    def load(cls, collection_id: int) -> Optional['FaceIndex']:
+        """
+        Carrega o índice da coleção caso exista, reaproveitando o mapeamento do processo
+        enquanto os arquivos não forem regravados
+        """
+        path = cls.get_path(collection_id)
+        try:
+            # Cada gravação cria um novo meta.json: inode e data de modificação identificam a versão
+            try:
+                stat = os.stat(f"{path}/meta.json")
+            except FileNotFoundError:
+                cls.forget(collection_id)
+                return None
+            version = (stat.st_ino, stat.st_mtime_ns)
+
+            with cls._cache_lock:
+                cached = cls._cache.get(collection_id)
+                if cached and cached[0] == version:
+                    cls._cache.move_to_end(collection_id)
+                    return cached[1]
+
+            with open(f"{path}/meta.json") as f:
+                meta = json.load(f)
+
+            arrays = {name: np.load(f"{path}/{name}.npy", mmap_mode='r') for name in cls.files}
+            index = cls(**arrays, trained_size=meta['trained_size'])
+            cls.remember(collection_id, version, index)
+            return index
+        except Exception as e:
+            logger_error(__name__, e)
+            return None
+
+    @classmethod
+    def remember(cls, collection_id: int, version: tuple, index: 'FaceIndex'):
+        """
+        Guarda o índice mapeado, descartando os usados há mais tempo quando o limite de memória é atingido
+        """
+        with cls._cache_lock:
+            cls._cache[collection_id] = (version, index)
+            cls._cache.move_to_end(collection_id)
+
+            used = sum(cached.nbytes for _, cached in cls._cache.values())
+            while used > cls.cache_size and len(cls._cache) > 1:
+                _, (_, evicted) = cls._cache.popitem(last=False)
+                used -= evicted.nbytes
+
+    @classmethod
+    def forget(cls, collection_id: int):
+        """
+        Descarta o índice mapeado da coleção no processo atual
+        """
+        with cls._cache_lock:
+            cls._cache.pop(collection_id, None)
+
+    @classmethod
+    def invalidate(cls, collection_id: int):
+        """
+        Remove o índice da coleção (ex.: quando fotos são removidas)
+        """
+        cls.forget(collection_id)
+        shutil.rmtree(cls.get_path(collection_id), ignore_errors=True)
+
+    def save(self, collection_id: int):
+        """
+        Grava o índice em um diretório temporário e o substitui de uma só vez
+        """
+        path = self.get_path(collection_id)
+        temp_path = f"{path}.tmp-{os.getpid()}"
+        old_path = f"{path}.old-{os.getpid()}"
+
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+        for name in self.files:
+            np.save(f"{temp_path}/{name}.npy", getattr(self, name))
+
+        with open(f"{temp_path}/meta.json", "w") as f:
+            json.dump({'trained_size': self.trained_size, 'size': self.size}, f)
+
+        if os.path.exists(path):
+            os.rename(path, old_path)
+        os.rename(temp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    @classmethod
+    def assign(cls, vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        """
+        Retorna o índice do centróide mais próximo de cada vetor (processado em blocos)
+        """
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), cls.chunk_size):
+            block = vectors[start:start + cls.chunk_size]
+            assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        return assignments
+
+    @classmethod
+    def train_centroids(cls, vectors: np.ndarray, nlist: int) -> np.ndarray:
+        """
+        K-means esférico sobre uma amostra dos vetores
+        """
+        rng = np.random.default_rng(0)
+        sample_size = min(len(vectors), nlist * cls.train_sample)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(cls.train_iterations):
+            assignments = cls.assign(sample, centroids)
+            order = np.argsort(assignments, kind='stable')
+            counts = np.bincount(assignments, minlength=nlist)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+            # Soma os vetores de cada grupo em uma única passada
+            sums = np.zeros_like(centroids)
+            filled = counts > 0
+            sums[filled] = np.add.reduceat(sample[order], starts[filled], axis=0)
+
+            # Centróides vazios são reiniciados com pontos aleatórios da amostra
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(sample_size, int(empty.sum()), replace=False)]
+
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1
+            centroids = (sums / norms).astype(np.float32)
+
+        return centroids
+
+    @classmethod
+    def from_lists(cls, centroids, assignments, vectors, face_ids, photo_ids, trained_size) -> 'FaceIndex':
+        """
+        Ordena os vetores pela lista (centróide) a que pertencem
+        """
+        order = np.argsort(assignments, kind='stable')
+        counts = np.bincount(assignments, minlength=len(centroids))
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        return cls(
+            centroids=centroids,
+            offsets=offsets,
+            vectors=np.ascontiguousarray(vectors[order], dtype=np.float32),
+            face_ids=np.asarray(face_ids, dtype=np.int64)[order],
+            photo_ids=np.asarray(photo_ids, dtype=np.int64)[order],
+            trained_size=trained_size
+        )
+
+    @classmethod
+    def build(cls, face_ids, photo_ids, vectors: np.ndarray) -> 'FaceIndex':
+        """
+        Treina um novo índice com os embeddings (já normalizados) informados
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) < cls.min_faces:
+            centroids = np.zeros((1, vectors.shape[1] if vectors.ndim == 2 else 0), dtype=np.float32)
+            assignments = np.zeros(len(vectors), dtype=np.int64)
+        else:
+            nlist = min(4096, int(np.sqrt(len(vectors))))
+            centroids = cls.train_centroids(vectors, nlist)
+            assignments = cls.assign(vectors, centroids)
+
+        return cls.from_lists(centroids, assignments, vectors, face_ids, photo_ids, len(vectors))
+
+    def extend(self, face_ids, photo_ids, vectors: np.ndarray) -> 'FaceIndex':
+        """
+        Adiciona novos embeddings ao índice. O índice é treinado novamente quando o
+        tamanho dobra em relação ao último treino ou ultrapassa o mínimo para usar listas.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        all_vectors = np.concatenate([self.vectors, vectors]) if self.size else vectors
+        all_face_ids = np.concatenate([self.face_ids, face_ids])
+        all_photo_ids = np.concatenate([self.photo_ids, photo_ids])
+
+        total = len(all_vectors)
+        needs_training = total >= 2 * self.trained_size or (len(self.centroids) == 1 and total >= self.min_faces)
+        if needs_training:
+            return self.build(all_face_ids, all_photo_ids, all_vectors)
+
+        previous = np.repeat(np.arange(len(self.centroids)), np.diff(self.offsets))
+        assignments = np.concatenate([previous, self.assign(vectors, self.centroids)])
+        return self.from_lists(self.centroids, assignments, all_vectors, all_face_ids, all_photo_ids, self.trained_size)
+
+    def search(self, reference: np.ndarray, threshold: float, nprobe: Optional[int] = None):
+        """
+        Busca aproximada: compara a referência apenas com as listas mais próximas
+
+        Returns:
+            tuple: (ids das faces, ids das fotos, similaridades) acima do limiar
+        """
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        if nprobe >= len(self.centroids):
+            return self.search_exact(reference, threshold)
+
+        lists = np.argpartition(self.centroids @ reference, -nprobe)[-nprobe:]
+        positions = np.concatenate([
+            np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists
+        ])
+
+        similarities = self.vectors[positions] @ reference
+        matches = similarities >= threshold
+        positions = positions[matches]
+        return self.face_ids[positions], self.photo_ids[positions], similarities[matches]
+
+    def search_exact(self, reference: np.ndarray, threshold: float):
+        """
+        Busca exata (força bruta) em todos os vetores do índice
+        """
+        similarities = self.vectors @ reference
+        matches = np.flatnonzero(similarities >= threshold)
+        return self.face_ids[matches], self.photo_ids[matches], similarities[matches]
+
+    def report(self, threshold: float, queries: int = 100, nprobe: Optional[int] = None) -> dict:
+        """
+        Compara a busca aproximada com a exata usando faces do próprio índice como consulta
+
+        Returns:
+            dict: Recall médio e latência média (ms) de cada modo
+        """
+        rng = np.random.default_rng(0)
+        samples = rng.choice(self.size, min(queries, self.size), replace=False) if self.size else []
+        recalls, ann_times, exact_times = [], [], []
+
+        for position in samples:
+            reference = self.vectors[position]
+
+            started_at = time.perf_counter()
+            ann_ids, _, _ = self.search(reference, threshold, nprobe)
+            ann_times.append(time.perf_counter() - started_at)
+
+            started_at = time.perf_counter()
+            exact_ids, _, _ = self.search_exact(reference, threshold)
+            exact_times.append(time.perf_counter() - started_at)
+
+            if len(exact_ids):
+                recalls.append(len(np.intersect1d(ann_ids, exact_ids)) / len(exact_ids))
+
+        return {
+            'size': self.size,
+            'lists': len(self.centroids),
+            'nprobe': min(nprobe or self.nprobe, len(self.centroids)),
+            'queries': len(samples),
+            'threshold': threshold,
+            'recall': float(np.mean(recalls)) if recalls else 1.0,
+            'ann_ms': float(np.mean(ann_times) * 1000) if ann_times else 0.0,
+            'exact_ms': float(np.mean(exact_times) * 1000) if exact_times else 0.0,
+        }
+
+async def update_collection_index(collection_id: int) -> Optional[FaceIndex]:
+    """
+    Cria ou estende o índice da coleção com as faces ainda não indexadas nele
+    """
+    from app.services.face_reader import FaceReader
+
+    try:
+        index = FaceIndex.load(collection_id)
+
+        face_ids, photo_ids, vectors = await FaceReader([collection_id], index.max_face_id if index else 0).read_all()
+        if not len(face_ids):
+            return index
+
+        index = index.extend(face_ids, photo_ids, vectors) if index else FaceIndex.build(face_ids, photo_ids, vectors)
+        index.save(collection_id)
+
+        logger_info(__name__, f'Índice da coleção {collection_id} atualizado: {index.size} face(s) em {len(index.centroids)} lista(s)')
+        return index
+    except Exception as e:
+        logger_error(__name__, e)
+        raise
@@ -0,0 +1,65 @@
+import os
+import numpy as np
+from app.models.face import Face
+from app.services.embedding import EMBEDDING_SIZE, decode_embeddings
+
+class FaceReader:
+    """
+    Leitura em fluxo das faces indexadas de coleções.
+    Lê apenas (id da face, id da foto, embedding) em lotes de tamanho fixo, paginando pelo id
+    da face (keyset), de forma que a memória usada não depende do tamanho das coleções.
+    """
+    batch_size = int(os.getenv("FACE_READER_BATCH_SIZE", 20000))  # Faces por lote
+
+    def __init__(self, collection_ids, min_face_id: int = 0, batch_size: int = None):
+        """
+        Args:
+            collection_ids: Ids das coleções
+            min_face_id (int): Considera apenas faces com id maior que este valor
+            batch_size (int, optional): Faces por lote
+        """
+        self.collection_ids = list(collection_ids)
+        self.min_face_id = min_face_id
+        self.batch_size = max(1, batch_size or self.batch_size)
+
+    async def batches(self):
+        """
+        Gera os lotes de faces em ordem de id
+
+        Yields:
+            tuple: (ids das faces, ids das fotos, matriz de embeddings normalizada)
+        """
+        last_id = self.min_face_id
+        while True:
+            rows = await Face.filter(
+                photo__owner_id__in=self.collection_ids,
+                photo__owner_type="collection",
+                photo__is_indexed=True,
+                embedding__isnull=False,
+                id__gt=last_id
+            ).order_by('id').limit(self.batch_size).values_list('id', 'photo_id', 'embedding')
+
+            if not rows:
+                break
+
+            face_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            photo_ids = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+            last_id = int(face_ids[-1])
+
+            # Os embeddings já são gravados normalizados
+            yield face_ids, photo_ids, decode_embeddings(row[2] for row in rows)
+
+            if len(rows) < self.batch_size:
+                break
+
+    async def read_all(self):
+        """
+        Lê todas as faces, mantendo em memória apenas as matrizes e um lote de registros por vez
+
+        Returns:
+            tuple: (ids das faces, ids das fotos, matriz de embeddings normalizada)
+        """
+        batches = [batch async for batch in self.batches()]
+        if not batches:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty((0, EMBEDDING_SIZE), dtype=np.float32)
+        return tuple(np.concatenate(values) for values in zip(*batches))
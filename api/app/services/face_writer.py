@@ -0,0 +1,159 @@
+import os
+import time
+import asyncio
+from tortoise import transactions
+from app.models.face import Face
+from app.services.face_index import FaceIndex
+from app.utils import logger_info, logger_error, reserve_ids
+
+class FaceWriter:
+    """
+    Acumula as faces detectadas e o status de várias fotos e grava tudo em lotes.
+    Cada lote é gravado em uma única transação: ou todas as fotos do lote ficam indexadas
+    com suas faces, ou nenhuma (e elas continuam pendentes para a próxima execução).
+    """
+    batch_size = int(os.getenv("FACE_WRITER_BATCH_SIZE", 200))  # Fotos por lote
+    flush_interval = float(os.getenv("FACE_WRITER_FLUSH_INTERVAL", 5))  # Segundos entre gravações
+
+    def __init__(self, batch_size: int = None, flush_interval: float = None, model_version: str = None):
+        self.model_version = model_version
+        self.batch_size = max(1, batch_size or self.batch_size)
+        self.flush_interval = flush_interval if flush_interval is not None else self.flush_interval
+        self.pending = []
+        self.last_flush = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def add(self, photo, faces: list):
+        """
+        Adiciona o resultado da análise de uma foto, gravando o lote quando ele
+        atinge o tamanho configurado ou quando o intervalo de gravação expira
+
+        Args:
+            photo (Photo): Foto analisada
+            faces (list): Resultado de `Recognition.analyze`
+        """
+        self.pending.append((photo, faces))
+        if len(self.pending) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            await self.flush()
+
+    async def flush(self) -> int:
+        """
+        Grava as fotos pendentes
+
+        Returns:
+            int: Quantidade de fotos gravadas
+        """
+        async with self.lock:
+            batch, self.pending = self.pending, []
+            self.last_flush = time.monotonic()
+            if not batch:
+                return 0
+
+            try:
+                await self.write(batch, self.model_version)
+                return len(batch)
+            except Exception as e:
+                logger_error(__name__, e)
+                if len(batch) == 1:
+                    return 0
+
+            # Em caso de falha do lote, grava foto a foto para isolar a que causou o erro
+            written = 0
+            for item in batch:
+                try:
+                    await self.write([item], self.model_version)
+                    written += 1
+                except Exception as e:
+                    logger_error(__name__, e)
+
+            logger_info(__name__, f'Lote gravado individualmente: {written} de {len(batch)} foto(s)')
+            return written
+
+    @staticmethod
+    def status_query(batch: list, model_version: str = None) -> tuple:
+        """
+        Monta a atualização do status de todas as fotos do lote em um único comando
+
+        Returns:
+            tuple: (SQL, parâmetros)
+        """
+        return """
+            UPDATE photos SET is_indexed = true, face_count = indexed.face_count, model_version = $1
+            FROM unnest($2::int[], $3::int[]) AS indexed(id, face_count)
+            WHERE photos.id = indexed.id
+        """, [
+            model_version,
+            [photo.id for photo, _ in batch],
+            [len(faces) for _, faces in batch],
+        ]
+
+    @classmethod
+    async def write(cls, batch: list, model_version: str = None):
+        """
+        Grava um lote de fotos em uma única transação.
+        Faces de uma execução anterior das mesmas fotos são substituídas, o que torna a gravação idempotente.
+
+        Args:
+            batch (list): Lista de tuplas (foto, faces)
+            model_version (str, optional): Versão do modelo que gerou as faces (ver `Recognition.get_model_version`)
+        """
+        photo_ids = [photo.id for photo, _ in batch]
+        saved_paths = []
+        replaced_paths = []
+        previous_faces = []
+        try:
+            async with transactions.in_transaction() as conn:
+                previous_faces = await Face.filter(photo_id__in=photo_ids).using_db(conn).values_list('id', 'photo_id')
+                if previous_faces:
+                    photos_by_id = {photo.id: photo for photo, _ in batch}
+                    replaced_paths = [Face.build_face_path(photos_by_id[photo_id], face_id) for face_id, photo_id in previous_faces]
+                    await Face.filter(photo_id__in=photo_ids).using_db(conn).delete()
+
+                total = sum(len(faces) for _, faces in batch)
+                face_ids = iter(await reserve_ids(Face._meta.db_table, total) if total else [])
+
+                records = []
+                for photo, faces in batch:
+                    for face in faces:
+                        face_id = next(face_ids)
+                        records.append(Face(
+                            id=face_id,
+                            data=face["data"],
+                            embedding=face["embedding"],
+                            user_id=photo.user_id,
+                            photo_id=photo.id,
+                        ))
+
+                        # Salvar o recorte da face na pasta local
+                        face_path = Face.build_face_path(photo, face_id)
+                        os.makedirs(os.path.dirname(face_path), exist_ok=True)
+                        with open(face_path, "wb") as f:
+                            f.write(face["crop"])
+                        saved_paths.append(face_path)
+
+                if records:
+                    await Face.bulk_create(records, batch_size=1000, using_db=conn)
+
+                await conn.execute_query(*cls.status_query(batch, model_version))
+        except Exception:
+            # Remove os recortes de uma transação que não foi concluída
+            for face_path in saved_paths:
+                if os.path.exists(face_path):
+                    os.remove(face_path)
+            raise
+
+        # Remove os recortes das faces substituídas
+        for face_path in replaced_paths:
+            if os.path.exists(face_path):
+                os.remove(face_path)
+
+        # Os índices das coleções deixam de conter as faces substituídas
+        if previous_faces:
+            replaced_photo_ids = {photo_id for _, photo_id in previous_faces}
+            for collection_id in {photo.owner_id for photo, _ in batch if photo.id in replaced_photo_ids and photo.owner_type == 'collection'}:
+                FaceIndex.invalidate(collection_id)
+
+        for photo, faces in batch:
+            photo.face_count = len(faces)
+            photo.is_indexed = True
+            photo.model_version = model_version
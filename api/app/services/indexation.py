@@ -0,0 +1,169 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from app.services.recognition import Recognition
+from app.services.face_writer import FaceWriter
+from app.services.analysis_cache import AnalysisCache
+from app.utils import logger_info, logger_error
+
+# Instância do reconhecimento de cada processo de trabalho
+_recognition = None
+
+def _init_worker(intra_op_threads: int):
+    """
+    Inicializa o processo de trabalho com sua própria sessão do FaceAnalysis.
+    Sem um perfil explícito, cada processo usa apenas a sua parte dos núcleos (sem paralelismo
+    entre operadores), evitando que os processos disputem os mesmos núcleos.
+    """
+    global _recognition
+    if not Recognition.runtime['intra_op_threads']:
+        Recognition.runtime['intra_op_threads'] = intra_op_threads
+        Recognition.runtime['inter_op_threads'] = Recognition.runtime['inter_op_threads'] or 1
+    _recognition = Recognition.get_instance()
+
+def _ping() -> int:
+    return os.getpid()
+
+def _analyze_many(file_paths: list) -> list:
+    """
+    Decodifica, detecta e gera os embeddings das faces de um grupo de imagens no processo de trabalho,
+    gravando também as versões reduzidas de cada foto
+    """
+    return _recognition.analyze_many(file_paths, renditions=True)
+
+class IndexationPool:
+    """
+    Pool de processos para a etapa pesada da indexação (decodificação, detecção e embedding).
+    Cada processo mantém sua própria sessão do modelo; o lado assíncrono apenas grava os resultados.
+    """
+    workers = int(os.getenv("INDEXATION_WORKERS", os.cpu_count() or 1))
+    batch_size = int(os.getenv("INDEXATION_BATCH_SIZE", 50))  # Fotos por lote na extração em fluxo
+    chunk_size = int(os.getenv("INDEXATION_CHUNK_SIZE", 500))  # Fotos por parte na indexação distribuída
+    preload = os.getenv("INDEXATION_PRELOAD", "0") == "1"  # Inicia os processos junto com o worker do Celery
+    photos_per_task = int(os.getenv("INDEXATION_PHOTOS_PER_TASK", 4))  # Fotos analisadas juntas por processo
+    _shared = None
+
+    def __init__(self, workers: int = None):
+        self.workers = max(1, workers or self.workers)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.threads_per_worker,)
+        )
+
+    @property
+    def threads_per_worker(self) -> int:
+        """
+        Núcleos disponíveis para cada processo de trabalho
+        """
+        return max(1, (os.cpu_count() or 1) // self.workers)
+
+    @classmethod
+    def shared(cls) -> 'IndexationPool':
+        """
+        Retorna o pool do processo atual. Os processos de trabalho (e seus modelos) são
+        mantidos entre as tarefas para não recarregar o modelo a cada indexação.
+        """
+        # Um pool quebrado (processo encerrado abruptamente) é substituído por um novo
+        if cls._shared is None or cls._shared.executor._broken:
+            cls._shared = cls()
+        return cls._shared
+
+    def warm_up(self):
+        """
+        Inicia todos os processos de trabalho, carregando e aquecendo o modelo em cada um
+        """
+        pids = set(future.result() for future in [self.executor.submit(_ping) for _ in range(self.workers)])
+        logger_info(__name__, f'Pool de indexação iniciado com {len(pids)} processo(s)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    async def analyze_many(self, file_paths: list) -> list:
+        """
+        Analisa um grupo de imagens em um dos processos de trabalho
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, _analyze_many, file_paths)
+
+    async def index_photos(self, photos, progress=None) -> int:
+        """
+        Indexa as fotos em paralelo, em grupos de `photos_per_task` fotos (cujas faces passam juntas
+        pelo modelo de reconhecimento), mantendo no máximo dois grupos em andamento por processo
+
+        Args:
+            photos (list): Fotos a serem indexadas
+            progress (ProgressReporter, optional): Progresso do processamento
+        Returns:
+            int: Quantidade de faces encontradas
+        """
+        semaphore = asyncio.Semaphore(self.workers * 2)
+        model_version = Recognition.get_model_version()
+        writer = FaceWriter(model_version=model_version)
+        cached = await AnalysisCache.lookup(photos, model_version)
+        face_counter = 0
+
+        async def index_group(group):
+            nonlocal face_counter
+            async with semaphore:
+                try:
+                    results = await self.analyze_many([photo.file_path for photo in group])
+                except Exception as e:
+                    # As fotos continuam não indexadas e serão processadas novamente na próxima execução
+                    logger_error(__name__, e)
+                    results = [None] * len(group)
+
+            for photo, faces in zip(group, results):
+                if faces is None:
+                    if progress:
+                        await progress.update(done=1)
+                    continue
+                await writer.add(photo, faces)
+                face_counter += len(faces)
+                if progress:
+                    await progress.update(done=1, faces=len(faces))
+
+        # Fotos com resultado reaproveitado não passam pelos processos de trabalho
+        for photo in photos:
+            if photo.id in cached:
+                await writer.add(photo, cached[photo.id])
+                face_counter += len(cached[photo.id])
+                if progress:
+                    await progress.update(done=1, faces=len(cached[photo.id]))
+
+        pending = [photo for photo in photos if photo.id not in cached]
+        size = max(1, self.photos_per_task)
+        await asyncio.gather(*(index_group(pending[i:i + size]) for i in range(0, len(pending), size)))
+        await writer.flush()
+        if progress:
+            await progress.flush()
+        logger_info(__name__, f'{len(photos)} foto(s) processada(s) com {self.workers} processo(s), {len(cached)} reaproveitada(s): {face_counter} face(s)')
+        return face_counter
+
+    async def index_batches(self, batches: asyncio.Queue, progress=None, concurrency: int = 2) -> int:
+        """
+        Indexa os lotes de fotos recebidos pela fila até receber `None`,
+        mantendo no máximo `concurrency` lotes em andamento
+
+        Returns:
+            int: Quantidade de faces encontradas
+        """
+        running = set()
+        face_counter = 0
+        while (batch := await batches.get()) is not None:
+            running.add(asyncio.create_task(self.index_photos(batch, progress)))
+            if len(running) >= concurrency:
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                face_counter += sum(task.result() for task in done)
+
+        if running:
+            face_counter += sum(await asyncio.gather(*running))
+        return face_counter
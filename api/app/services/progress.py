@@ -0,0 +1,156 @@
+import os
+import time
+from app.models.job import Job
+from app.services.sse_manager import sse_manager
+from app.utils import logger_error
+
+class ProgressReporter:
+    """
+    Progresso de um processamento longo (indexação de coleção ou pesquisa de faces).
+    Os contadores ficam no Redis para que partes executadas em workers diferentes somem no
+    mesmo progresso, e os eventos são agrupados: no máximo um a cada `interval` segundos por
+    processamento, independente de quantos workers contribuem.
+    """
+    interval = float(os.getenv("PROGRESS_EVENT_INTERVAL", 5))
+    expire = 24 * 60 * 60  # Contadores de processamentos interrompidos expiram em um dia
+    units = {'photos': 'foto(s)', 'collections': 'coleção(ões)'}
+
+    def __init__(self, entity: str, entity_id: int, user_id: int, name: str, unit: str = 'photos'):
+        self.entity = entity
+        self.entity_id = entity_id
+        self.user_id = user_id
+        self.name = name
+        self.unit = unit
+        self.key = f"progress:{entity}:{entity_id}"
+        self.pending_done = 0
+        self.pending_faces = 0
+        self.last_flush = time.monotonic()
+
+    @property
+    def redis(self):
+        return sse_manager.redis_conn
+
+    async def state(self) -> dict:
+        """
+        Retorna os contadores atuais do processamento
+        """
+        return await self.redis.hgetall(self.key)
+
+    async def start(self, total: int = 0, job_id: int = None, reset: bool = True):
+        """
+        Inicia (ou continua, com reset=False) o processamento
+
+        Args:
+            total (int): Quantidade total de itens
+            job_id (int): Job onde o progresso é gravado
+            reset (bool): Zera os contadores de uma execução anterior
+        """
+        try:
+            if reset:
+                await self.redis.delete(self.key)
+            await self.redis.hsetnx(self.key, 'started_at', time.time())
+            await self.set_total(total, job_id)
+        except Exception as e:
+            logger_error(__name__, e)
+
+    async def set_total(self, total: int, job_id: int = None):
+        """
+        Atualiza o total de itens (ex.: conforme a extração avança) e o job do processamento
+        """
+        try:
+            mapping = {'total': total}
+            if job_id:
+                mapping['job_id'] = job_id
+            await self.redis.hset(self.key, mapping=mapping)
+            await self.redis.expire(self.key, self.expire)
+        except Exception as e:
+            logger_error(__name__, e)
+
+    async def update(self, done: int = 0, faces: int = 0):
+        """
+        Acumula o progresso localmente e o envia ao Redis a cada `interval` segundos
+        """
+        self.pending_done += done
+        self.pending_faces += faces
+        if time.monotonic() - self.last_flush >= self.interval:
+            await self.flush()
+
+    async def send_pending(self):
+        """
+        Soma o progresso acumulado localmente aos contadores do Redis
+        """
+        self.last_flush = time.monotonic()
+        done, faces = self.pending_done, self.pending_faces
+        self.pending_done = self.pending_faces = 0
+        if done:
+            await self.redis.hincrby(self.key, 'done', done)
+        if faces:
+            await self.redis.hincrby(self.key, 'faces', faces)
+
+    async def flush(self):
+        """
+        Envia o progresso acumulado e publica um evento caso nenhum outro worker
+        tenha publicado no intervalo atual
+        """
+        try:
+            await self.send_pending()
+            if await self.redis.set(f"{self.key}:event", 1, nx=True, px=int(self.interval * 1000)):
+                await self.publish(await self.state())
+        except Exception as e:
+            logger_error(__name__, e)
+
+    def snapshot(self, state: dict) -> dict:
+        """
+        Calcula o progresso (itens por segundo e tempo restante) a partir dos contadores
+        """
+        done = int(state.get('done', 0))
+        total = max(int(state.get('total', 0)), done)
+        elapsed = max(time.time() - float(state.get('started_at', time.time())), 0.001)
+        rate = done / elapsed
+
+        return {
+            'done': done,
+            'total': total,
+            'faces': int(state.get('faces', 0)),
+            'unit': self.unit,
+            'rate': round(rate, 2),
+            'eta': round((total - done) / rate) if rate else None,
+            'elapsed': round(elapsed),
+        }
+
+    async def publish(self, state: dict):
+        """
+        Grava o progresso no job e o publica via SSE (evento 'progress')
+        """
+        snapshot = self.snapshot(state)
+        if state.get('job_id'):
+            await Job.filter(id=int(state['job_id'])).update(progress=snapshot)
+
+        unit = self.units.get(self.unit, self.unit)
+        await sse_manager.publish(
+            self.user_id,
+            {
+                'event': 'progress',
+                'entity': self.entity,
+                'id': self.entity_id,
+                **snapshot,
+                'message': f"{self.name}: {snapshot['done']}/{snapshot['total']} {unit}, "
+                           f"{snapshot['faces']} face(s), {snapshot['rate']} {unit}/s"
+            },
+            'progress'
+        )
+
+    async def finish(self):
+        """
+        Publica o progresso final (100%), mesmo dentro do intervalo de eventos, e remove os
+        contadores do processamento concluído
+        """
+        try:
+            await self.send_pending()
+            state = await self.state()
+            if state:
+                state['done'] = max(int(state.get('done', 0)), int(state.get('total', 0)))
+                await self.publish(state)
+            await self.redis.delete(self.key, f"{self.key}:event")
+        except Exception as e:
+            logger_error(__name__, e)
@@ -0,0 +1,229 @@
+"""
+Geração e validação da variante int8 dos modelos de reconhecimento.
+
+Uso (dentro do container da API):
+    python -m app.services.quantization quantize <pasta de imagens>
+    python -m app.services.quantization validate <pasta de imagens> [tolerância]
+
+A quantização estática (QDQ) de detecção e reconhecimento é calibrada com as imagens da pasta;
+os demais módulos (gênero/idade e landmarks) são copiados sem alteração. A validação compara as
+faces, os embeddings e as decisões de correspondência dos modelos int8 com os originais (fp32).
+Depois de validado, o modelo é selecionado com RECOGNITION_PRECISION=int8.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import cv2
+import numpy as np
+from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+from insightface.utils import face_align
+from app.services.recognition import Recognition
+from app.services.embedding import decode_embedding
+from app.utils import logger_info, logger_error
+
+CALIBRATION_SIZE = int(os.getenv("QUANTIZATION_CALIBRATION_SIZE", 200))  # Imagens usadas na calibração
+QUANTIZED_TASKS = ('detection', 'recognition')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+class BlobReader(CalibrationDataReader):
+    """
+    Entrega as entradas de calibração de um modelo, uma por vez
+    """
+    def __init__(self, input_name: str, blobs):
+        self.input_name = input_name
+        self.blobs = iter(blobs)
+
+    def get_next(self):
+        blob = next(self.blobs, None)
+        return {self.input_name: blob} if blob is not None else None
+
+def list_images(image_dir: str) -> list:
+    return sorted(
+        path for path in glob.glob(os.path.join(image_dir, '**', '*'), recursive=True)
+        if path.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+def detection_blob(model, img: np.ndarray) -> np.ndarray:
+    """
+    Reproduz o pré-processamento do RetinaFace (redimensionamento com borda até o tamanho de entrada)
+    """
+    width, height = model.input_size
+    ratio = min(width / img.shape[1], height / img.shape[0])
+    resized = cv2.resize(img, (int(img.shape[1] * ratio), int(img.shape[0] * ratio)))
+    det_img = np.zeros((height, width, 3), dtype=np.uint8)
+    det_img[:resized.shape[0], :resized.shape[1], :] = resized
+    mean = model.input_mean
+    return cv2.dnn.blobFromImage(det_img, 1.0 / model.input_std, (width, height), (mean, mean, mean), swapRB=True)
+
+def recognition_blob(model, img: np.ndarray, face) -> np.ndarray:
+    """
+    Reproduz o pré-processamento do ArcFace (alinhamento pelos pontos da face)
+    """
+    aligned = face_align.norm_crop(img, landmark=face.kps, image_size=model.input_size[0])
+    mean = model.input_mean
+    return cv2.dnn.blobFromImages([aligned], 1.0 / model.input_std, model.input_size, (mean, mean, mean), swapRB=True)
+
+def calibration_blobs(recognition: Recognition, images: list) -> dict:
+    """
+    Gera as entradas de calibração dos modelos quantizados usando o modelo original
+    """
+    blobs = {taskname: [] for taskname in QUANTIZED_TASKS}
+    for file_path in images[:CALIBRATION_SIZE]:
+        try:
+            _, img, _, _, faces, _ = recognition.prepare(file_path)
+        except Exception as e:
+            logger_error(__name__, e)
+            continue
+
+        blobs['detection'].append(detection_blob(recognition.app.det_model, img))
+        blobs['recognition'].extend(recognition_blob(recognition.app.models['recognition'], img, face) for face in faces)
+    return blobs
+
+def quantize(image_dir: str) -> str:
+    """
+    Gera a variante int8 do modelo na pasta de modelos do InsightFace
+
+    Returns:
+        str: Pasta do modelo gerado
+    """
+    images = list_images(image_dir)
+    if not images:
+        raise ValueError(f'Nenhuma imagem encontrada em {image_dir}')
+
+    recognition = Recognition.load('full', 'fp32')
+    source_dir = os.path.join(Recognition.model_path, 'models', Recognition.get_model_name('fp32'))
+    target_dir = os.path.join(Recognition.model_path, 'models', Recognition.get_model_name('int8'))
+    temp_dir = f"{target_dir}.tmp-{os.getpid()}"
+
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+    try:
+        blobs = calibration_blobs(recognition, images)
+        quantized = {model.model_file: taskname for taskname, model in recognition.app.models.items() if taskname in QUANTIZED_TASKS}
+
+        for model_file in sorted(glob.glob(os.path.join(source_dir, '*.onnx'))):
+            target_file = os.path.join(temp_dir, os.path.basename(model_file))
+            taskname = quantized.get(model_file)
+            if taskname is None or not blobs[taskname]:
+                shutil.copyfile(model_file, target_file)
+                continue
+
+            started_at = time.perf_counter()
+            input_name = recognition.app.models[taskname].session.get_inputs()[0].name
+            quantize_static(
+                model_file,
+                target_file,
+                BlobReader(input_name, blobs[taskname]),
+                quant_format=QuantFormat.QDQ,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                per_channel=True
+            )
+            logger_info(__name__, f'{os.path.basename(model_file)} ({taskname}) quantizado com {len(blobs[taskname])} amostra(s) em {time.perf_counter() - started_at:.1f}s')
+
+        shutil.rmtree(target_dir, ignore_errors=True)
+        os.rename(temp_dir, target_dir)
+        return target_dir
+    except Exception:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+
+def pair_faces(reference: list, candidates: list, min_iou: float = 0.5) -> list:
+    """
+    Associa as faces detectadas pelos dois modelos pela sobreposição das caixas
+
+    Returns:
+        list: Tuplas (face de referência, face candidata)
+    """
+    pairs = []
+    used = set()
+    for face in reference:
+        x1, y1, x2, y2 = face['data']['bbox']
+        best, best_iou = None, min_iou
+        for position, candidate in enumerate(candidates):
+            if position in used:
+                continue
+            cx1, cy1, cx2, cy2 = candidate['data']['bbox']
+            inter = max(0, min(x2, cx2) - max(x1, cx1)) * max(0, min(y2, cy2) - max(y1, cy1))
+            union = (x2 - x1) * (y2 - y1) + (cx2 - cx1) * (cy2 - cy1) - inter
+            iou = inter / union if union > 0 else 0
+            if iou >= best_iou:
+                best, best_iou = position, iou
+        if best is not None:
+            used.add(best)
+            pairs.append((face, candidates[best]))
+    return pairs
+
+def validate(image_dir: str, tolerance_level: int = 60) -> dict:
+    """
+    Compara o modelo int8 com o original nas imagens da pasta
+
+    Returns:
+        dict: Concordância da detecção, similaridade entre os embeddings, concordância das
+            decisões de correspondência (no limiar da tolerância) e tempo médio por imagem
+    """
+    images = list_images(image_dir)
+    if not images:
+        raise ValueError(f'Nenhuma imagem encontrada em {image_dir}')
+
+    models = {precision: Recognition.load(Recognition.profile, precision) for precision in ('fp32', 'int8')}
+    timings = {precision: [] for precision in models}
+    detected = {precision: 0 for precision in models}
+    reference_embeddings, quantized_embeddings = [], []
+
+    for file_path in images:
+        results = {}
+        for precision, recognition in models.items():
+            started_at = time.perf_counter()
+            results[precision] = recognition.analyze(file_path)
+            timings[precision].append(time.perf_counter() - started_at)
+            detected[precision] += len(results[precision])
+
+        for reference, candidate in pair_faces(results['fp32'], results['int8']):
+            reference_embeddings.append(decode_embedding(reference['embedding']))
+            quantized_embeddings.append(decode_embedding(candidate['embedding']))
+
+    report = {
+        'images': len(images),
+        'faces_fp32': detected['fp32'],
+        'faces_int8': detected['int8'],
+        'paired_faces': len(reference_embeddings),
+        'threshold': tolerance_level * 0.01,
+        'ms_fp32': float(np.mean(timings['fp32']) * 1000),
+        'ms_int8': float(np.mean(timings['int8']) * 1000),
+    }
+    report['speedup'] = report['ms_fp32'] / report['ms_int8'] if report['ms_int8'] else None
+
+    if reference_embeddings:
+        # Os embeddings já são gravados normalizados
+        reference = np.asarray(reference_embeddings, dtype=np.float32)
+        quantized = np.asarray(quantized_embeddings, dtype=np.float32)
+        similarities = np.sum(reference * quantized, axis=1)
+        report['embedding_similarity_mean'] = float(similarities.mean())
+        report['embedding_similarity_min'] = float(similarities.min())
+
+        # Decisões de correspondência entre todos os pares de faces
+        upper = np.triu_indices(len(reference), 1)
+        if len(upper[0]):
+            fp32_matches = (reference @ reference.T)[upper] >= report['threshold']
+            int8_matches = (quantized @ quantized.T)[upper] >= report['threshold']
+            report['pairs'] = len(upper[0])
+            report['decision_agreement'] = float(np.mean(fp32_matches == int8_matches))
+            report['matches_fp32'] = int(fp32_matches.sum())
+            report['matches_int8'] = int(int8_matches.sum())
+
+    return report
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in ('quantize', 'validate'):
+        print(__doc__)
+        sys.exit(1)
+
+    if sys.argv[1] == 'quantize':
+        print(quantize(sys.argv[2]))
+    else:
+        tolerance_level = int(sys.argv[3]) if len(sys.argv) > 3 else 60
+        print(json.dumps(validate(sys.argv[2], tolerance_level), indent=2))
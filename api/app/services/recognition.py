@@ -1,39 +1,210 @@
-import asyncio
-from pathlib import Path
+from io import BytesIO
 from insightface.app import FaceAnalysis
-from PIL import Image
+from insightface.app.common import Face as InsightFace
+from insightface.utils import face_align
+from PIL import Image, ImageOps
 import numpy as np
-from app.models.face import Face
-from app.models.photo import Photo
-from app.models.search_face import SearchFace
-from app.models.search import Search
+import onnxruntime as ort
+from app.services.embedding import encode_embedding
+from app.services.face_writer import FaceWriter
+from app.services.analysis_cache import AnalysisCache
+from app.services.renditions import Renditions
+from app.services.cpu_executor import CpuExecutor, CpuExecutorSaturated
 from app.utils import logger_info, logger_error
 import os
+import threading
+
 class Recognition:
     model_path = '/app/files/system/insightface'
     model_name = 'buffalo_l'
+    # Precisão dos modelos: original (fp32) ou quantizada em int8 (gerada por `python -m app.services.quantization quantize`)
+    precisions = {
+        'fp32': model_name,
+        'int8': f'{model_name}_int8',
+    }
+    precision = os.getenv("RECOGNITION_PRECISION", "fp32")
+    preload = os.getenv("RECOGNITION_PRELOAD", "1") == "1"  # Carrega o modelo na inicialização do processo
+
+    # Perfis de inferência: módulos do modelo executados para cada face
+    profiles = {
+        'search-minimal': ['detection', 'recognition'],  # Apenas detecção e embedding (ArcFace)
+        'full': None,  # Todos os módulos (gênero/idade e landmarks 2d106/3d68)
+    }
+    profile = os.getenv("RECOGNITION_PROFILE", "search-minimal")
+    decode_size = int(os.getenv("RECOGNITION_DECODE_SIZE", 1280))  # Maior lado aproximado da imagem decodificada
+    reducible_modes = ('L', 'LA', 'I', 'F', 'RGB', 'RGBA', 'CMYK', 'PA')  # Modos aceitos pelo Image.reduce
+    batch_size = int(os.getenv("RECOGNITION_BATCH_SIZE", 32))  # Faces por execução do modelo de reconhecimento
+
+    # Perfil do ONNX Runtime, configurado por implantação. Com 0 threads o ONNX Runtime usa todos os
+    # núcleos, exceto nos processos do pool de indexação, que dividem os núcleos entre si
+    runtime = {
+        'intra_op_threads': int(os.getenv("ORT_INTRA_OP_THREADS", 0)),
+        'inter_op_threads': int(os.getenv("ORT_INTER_OP_THREADS", 0)),
+        'graph_optimization': os.getenv("ORT_GRAPH_OPTIMIZATION", "all"),  # disabled, basic, extended ou all
+        'execution_mode': os.getenv("ORT_EXECUTION_MODE", "sequential"),  # sequential ou parallel
+        'allow_spinning': os.getenv("ORT_ALLOW_SPINNING", "1") == "1",  # Threads ociosas aguardam ativamente
+        'providers': [provider for provider in os.getenv("ORT_PROVIDERS", "CPUExecutionProvider").split(",") if provider],
+    }
+    graph_optimizations = {
+        'disabled': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    execution_modes = {
+        'sequential': ort.ExecutionMode.ORT_SEQUENTIAL,
+        'parallel': ort.ExecutionMode.ORT_PARALLEL,
+    }
 
-    def __init__(self, app):
+    _instances = {}
+    _lock = threading.Lock()
+
+    def __init__(self, app, profile: str = None, precision: str = None):
         """
         Inicialização síncrona padrão.
         Recebe uma instância já configurada do FaceAnalysis.
         """
         self.app = app
+        self.profile = profile or self.profile
+        self.precision = precision or self.precision
+        self.attributes = sorted(app.models.keys())  # Módulos efetivamente carregados
+        self.model_version = self.get_model_version(self.profile, self.precision)
+
+    @classmethod
+    def get_model_name(cls, precision: str = None) -> str:
+        """
+        Retorna o nome (pasta) do modelo da precisão informada
+        """
+        precision = precision or cls.precision
+        if precision not in cls.precisions:
+            raise ValueError(f"Precisão '{precision}' inválida. Opções: {', '.join(cls.precisions)}")
+        return cls.precisions[precision]
+
+    @classmethod
+    def get_model_version(cls, profile: str = None, precision: str = None) -> str:
+        """
+        Identifica o modelo, o perfil de inferência e a resolução de decodificação que geraram
+        as faces de uma foto. Resultados só são reaproveitados entre fotos indexadas com a mesma versão.
+        """
+        return f"{cls.get_model_name(precision)}/{profile or cls.profile}/{cls.decode_size}"
+
+    @classmethod
+    def get_face_analyzer(cls, profile: str = None, precision: str = None):
+        profile = profile or cls.profile
+        if profile not in cls.profiles:
+            raise ValueError(f"Perfil de inferência '{profile}' inválido. Opções: {', '.join(cls.profiles)}")
+
+        model_name = cls.get_model_name(precision)
+        if model_name != cls.model_name and not os.path.exists(os.path.join(cls.model_path, 'models', model_name)):
+            # Apenas o modelo original é baixado; as variantes são geradas localmente
+            raise FileNotFoundError(f"Modelo '{model_name}' não encontrado. Gere-o com: python -m app.services.quantization quantize <pasta de imagens>")
+
+        return FaceAnalysis(
+            name=model_name,
+            root=cls.model_path,
+            allowed_modules=cls.profiles[profile],
+            providers=cls.runtime['providers']
+        )
 
     @classmethod
-    def get_face_analyzer(cls):
-        return FaceAnalysis(name=cls.model_name,root=cls.model_path)
+    def get_session_options(cls) -> ort.SessionOptions:
+        """
+        Monta as opções das sessões do ONNX Runtime a partir do perfil de execução
+        """
+        runtime = cls.runtime
+        if runtime['graph_optimization'] not in cls.graph_optimizations:
+            raise ValueError(f"Otimização de grafo '{runtime['graph_optimization']}' inválida. Opções: {', '.join(cls.graph_optimizations)}")
+        if runtime['execution_mode'] not in cls.execution_modes:
+            raise ValueError(f"Modo de execução '{runtime['execution_mode']}' inválido. Opções: {', '.join(cls.execution_modes)}")
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = runtime['intra_op_threads']
+        options.inter_op_num_threads = runtime['inter_op_threads']
+        options.graph_optimization_level = cls.graph_optimizations[runtime['graph_optimization']]
+        options.execution_mode = cls.execution_modes[runtime['execution_mode']]
+        options.add_session_config_entry('session.intra_op.allow_spinning', '1' if runtime['allow_spinning'] else '0')
+        return options
+
+    @classmethod
+    def configure_sessions(cls, app):
+        """
+        Recria as sessões dos modelos com o perfil de execução.
+        O FaceAnalysis repassa apenas os providers ao ONNX Runtime, então as sessões são
+        substituídas depois da criação, mantendo os demais atributos de cada modelo.
+        """
+        options = cls.get_session_options()
+        for model in app.models.values():
+            model.session = ort.InferenceSession(model.model_file, sess_options=options, providers=cls.runtime['providers'])
+
+        runtime = cls.runtime
+        logger_info(
+            __name__,
+            f"ONNX Runtime: {runtime['intra_op_threads'] or 'auto'} thread(s) intra-op, "
+            f"{runtime['inter_op_threads'] or 'auto'} inter-op, otimização {runtime['graph_optimization']}, "
+            f"modo {runtime['execution_mode']}, providers {', '.join(runtime['providers'])}"
+        )
 
     @classmethod
-    async def create(cls):
+    def load(cls, profile: str = None, precision: str = None):
         """
-        Factory method assíncrono para criação da instância.
+        Criação síncrona de uma nova instância.
         Garante o download do modelo se necessário.
         """
-        app = cls.get_face_analyzer()
+        app = cls.get_face_analyzer(profile, precision)
+        cls.configure_sessions(app)
         app.prepare(ctx_id=0, det_size=(640, 640))
         
-        return cls(app)
+        return cls(app, profile, precision)
+
+    @classmethod
+    def get_instance(cls, profile: str = None):
+        """
+        Retorna a instância compartilhada do processo para o perfil informado.
+        O modelo é carregado e aquecido apenas na primeira chamada.
+        """
+        profile = profile or cls.profile
+        if profile not in cls._instances:
+            with cls._lock:
+                if profile not in cls._instances:
+                    instance = cls.load(profile)
+                    instance.warm_up()
+                    cls._instances[profile] = instance
+                    logger_info(__name__, f"Modelo '{cls.get_model_name()}' ({profile}) carregado no processo {os.getpid()}")
+        return cls._instances[profile]
+
+    @classmethod
+    async def create(cls, profile: str = None):
+        """
+        Factory method assíncrono que retorna a instância compartilhada do processo.
+        Garante o download do modelo se necessário.
+        O carregamento é feito no executor de CPU para não bloquear o loop de eventos.
+        """
+        if (profile or cls.profile) in cls._instances:
+            return cls._instances[profile or cls.profile]
+        return await CpuExecutor.shared().run('load_model', cls.get_instance, profile)
+
+    def warm_up(self):
+        """
+        Executa uma inferência em imagens vazias para inicializar as sessões do ONNX Runtime
+        """
+        try:
+            img = np.zeros((640, 640, 3), dtype=np.uint8)
+            self.app.get(img)
+
+            # Sem faces na imagem vazia os demais modelos são executados com uma face fictícia
+            face = InsightFace(
+                bbox=np.array([0, 0, 112, 112], dtype=np.float32),
+                kps=face_align.arcface_dst.copy(),
+                det_score=1.0
+            )
+            for taskname, model in self.app.models.items():
+                if taskname != 'detection':
+                    model.get(img, face)
+
+            # Lote completo do reconhecimento
+            self.embed([(img, face)] * self.batch_size)
+        except Exception as e:
+            logger_error(__name__, e)
     
     @classmethod
     def is_model_downloaded(cls):
@@ -53,101 +224,229 @@ class Recognition:
             logger_info(__name__, f"Baixando modelo '{cls.model_name}' para reconhecimento")
 
             # Executa o prepare em uma thread separada (pois é uma operação bloqueante)
-            app = cls.get_face_analyzer()
+            app = cls.get_face_analyzer(precision='fp32')
             app.prepare(ctx_id=0, det_size=(640, 640))
         except Exception as e:
             logger_error(__name__, e)
             raise
     
-    async def compare_faces(self, search: Search, face: dict):
+    @classmethod
+    def decode_image(cls, file_path: str, max_size: int = None):
         """
-        Compara duas faces e cria um registro de face na busca caso o nível de similaridade 
-        seja maior ou igual ao nível de tolerância
+        Decodifica a imagem próxima da resolução usada na detecção.
+        JPEGs usam o modo draft (redução na própria decodificação) e os demais formatos
+        usam Image.reduce; a orientação EXIF é aplicada já na imagem reduzida.
+
+        Args:
+            file_path (str): Caminho da imagem
+            max_size (int): Tamanho aproximado do maior lado da imagem decodificada
+        Returns:
+            tuple: (imagem RGB reduzida, escala (x, y) para as coordenadas originais, formato original)
         """
-        try:
-            [photo_search_id] = await Photo.filter(
-                owner_id=search.id,
-                owner_type="search"
-            ).values_list('id', flat=True)
+        max_size = max_size or cls.decode_size
+        img = Image.open(file_path)
+        image_format = img.format
+        width, height = img.size
+        ratio = max_size / max(width, height)
+
+        if ratio < 1:
+            if image_format == 'JPEG':
+                img.draft('RGB', (int(np.ceil(width * ratio)), int(np.ceil(height * ratio))))
+            else:
+                factor = int(1 / ratio)
+                if factor > 1:
+                    # Paleta, 1 bit e 16 bits (I;16) não são aceitos pelo reduce
+                    if img.mode not in cls.reducible_modes:
+                        img = img.convert('RGB')
+                    img = img.reduce(factor)
+
+        # Orientação EXIF (5 a 8 trocam largura e altura)
+        orientation = img.getexif().get(0x0112, 1)
+        img = ImageOps.exif_transpose(img)
+        if orientation in (5, 6, 7, 8):
+            width, height = height, width
 
-            reference_face = await Face.filter(photo_id=photo_search_id).first()
+        # Tons de cinza, paleta e transparência são convertidos já na resolução reduzida
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
 
-            similarity = np.dot(reference_face.data['embedding'], face.data['embedding']) / (
-                np.linalg.norm(reference_face.data['embedding']) * np.linalg.norm(face.data['embedding'])
+        return img, (width / img.width, height / img.height), image_format
+
+    def detect(self, img: np.ndarray) -> list:
+        """
+        Detecta as faces da imagem (BGR) e executa os módulos por face, exceto o reconhecimento,
+        que é feito em lote por `embed`
+        """
+        bboxes, kpss = self.app.det_model.detect(img, max_num=0, metric='default')
+
+        faces = []
+        for i in range(bboxes.shape[0]):
+            face = InsightFace(
+                bbox=bboxes[i, 0:4],
+                kps=kpss[i] if kpss is not None else None,
+                det_score=bboxes[i, 4]
             )
+            for taskname, model in self.app.models.items():
+                if taskname not in ('detection', 'recognition'):
+                    model.get(img, face)
+            faces.append(face)
+
+        return faces
+
+    def embed(self, items: list):
+        """
+        Gera os embeddings de faces de uma ou mais imagens em micro-lotes: os recortes
+        alinhados de cada lote passam pelo modelo de reconhecimento em uma única execução
+
+        Args:
+            items (list): Tuplas (imagem BGR, face detectada); o embedding é gravado na própria face
+        """
+        model = self.app.models.get('recognition')
+        if model is None:
+            return
+
+        for start in range(0, len(items), self.batch_size):
+            batch = items[start:start + self.batch_size]
+            aligned = [
+                face_align.norm_crop(img, landmark=face.kps, image_size=model.input_size[0])
+                for img, face in batch
+            ]
+            embeddings = model.get_feat(aligned)
+            for (_, face), embedding in zip(batch, embeddings):
+                face.embedding = embedding.flatten()
+
+    def prepare(self, file_path: str) -> tuple:
+        """
+        Decodifica a imagem e detecta suas faces, ainda sem os embeddings
+        """
+        img_pil, scale, image_format = self.decode_image(file_path)
+
+        # Converte para BGR para ficar compativel com insightface (cópia apenas na resolução reduzida)
+        img = np.ascontiguousarray(np.asarray(img_pil)[:, :, ::-1])
+        return img_pil, img, scale, image_format, self.detect(img), file_path
 
-            if similarity >= float(search.tolerance_level*0.01):
-                has_face = await SearchFace.filter(search_id=search.id, face_id=face.id).exists()
-                if not has_face:
-                    face = await SearchFace.create(
-                        search_id=search.id,
-                        similarity=float(similarity),
-                        face_id=face.id,
-                        photo_id=face.photo_id,
-                        user_id=search.user_id
-                    )
-                    return face
+    def crop_faces(self, img_pil, scale, image_format, faces, file_path) -> list:
+        """
+        Recorta as faces da foto na resolução original: as coordenadas da imagem decodificada
+        são convertidas pela escala e a foto original só é aberta quando foi reduzida e tem faces
+
+        Returns:
+            list: Recortes codificados no formato da foto, na ordem das faces
+        """
+        if not faces:
+            return []
+
+        reduced = scale[0] > 1 or scale[1] > 1
+        source = ImageOps.exif_transpose(Image.open(file_path)) if reduced else img_pil
+        try:
+            crops = []
+            for face in faces:
+                bbox = face.bbox.reshape(2, 2) * scale if reduced else face.bbox.reshape(2, 2)
+                x1, y1, x2, y2 = np.round(bbox).astype(int).flatten()
+                face_img = source.crop((max(x1, 0), max(y1, 0), min(x2, source.width), min(y2, source.height)))
+                if face_img.mode != 'RGB':
+                    face_img = face_img.convert('RGB')
+
+                crop = BytesIO()
+                face_img.save(crop, format=image_format, optimize=True)
+                crops.append(crop.getvalue())
+            return crops
+        finally:
+            if source is not img_pil:
+                source.close()
+
+    def describe(self, img_pil, img, scale, image_format, faces, file_path) -> list:
+        """
+        Monta o resultado de cada face (coordenadas na resolução original, embedding e recorte codificados)
+        """
+        crops = self.crop_faces(img_pil, scale, image_format, faces, file_path)
+        scale = np.array(scale, dtype=np.float32)
+        results = []
+        for face, crop in zip(faces, crops):
+            results.append({
+                "data": {
+                    "bbox": (face.bbox.reshape(2, 2) * scale).flatten().tolist(),
+                    "kps": (face.kps * scale).tolist() if face.kps is not None else None,
+                    "landmark": (face.landmark_2d_106 * scale).tolist() if face.landmark_2d_106 is not None else None,
+                    "gender": int(face.gender) if face.gender is not None else None,
+                    "age": int(face.age) if face.age is not None else None,
+                    "score": float(face.det_score),
+                    "profile": self.profile,
+                    "attributes": self.attributes,
+                },
+                "embedding": encode_embedding(face.embedding) if face.embedding is not None else None,
+                "crop": crop,
+            })
+
+        return results
+
+    def save_renditions(self, img_pil, file_path: str):
+        """
+        Grava as versões reduzidas da foto aproveitando a imagem já decodificada
+        """
+        try:
+            Renditions.save(img_pil, file_path)
         except Exception as e:
+            # As versões ausentes são geradas no primeiro acesso
             logger_error(__name__, e)
-            raise
+
+    def analyze(self, file_path: str, renditions: bool = False) -> list:
+        """
+        Detecta as faces de uma imagem (etapa pesada de CPU, sem acesso ao banco)
+
+        Args:
+            file_path (str): Caminho da imagem
+            renditions (bool): Grava também as versões reduzidas da foto
+        Returns:
+            list: Dados de cada face detectada (coordenadas na resolução original),
+                com o embedding e o recorte já codificados
+        """
+        prepared = self.prepare(file_path)
+        if renditions:
+            self.save_renditions(prepared[0], file_path)
+        self.embed([(prepared[1], face) for face in prepared[4]])
+        return self.describe(*prepared)
+
+    def analyze_many(self, file_paths: list, renditions: bool = False) -> list:
+        """
+        Analisa várias imagens juntando as faces de todas elas nos lotes do modelo de reconhecimento
+
+        Args:
+            file_paths (list): Caminhos das imagens
+            renditions (bool): Grava também as versões reduzidas de cada foto
+        Returns:
+            list: Resultado de `analyze` de cada imagem, ou None para as que não puderam ser analisadas
+        """
+        prepared = []
+        for file_path in file_paths:
+            try:
+                prepared.append(self.prepare(file_path))
+                if renditions:
+                    self.save_renditions(prepared[-1][0], file_path)
+            except Exception as e:
+                logger_error(__name__, e)
+                prepared.append(None)
+
+        self.embed([(item[1], face) for item in prepared if item for face in item[4]])
+        return [self.describe(*item) if item else None for item in prepared]
 
     async def process_single_photo(self, photo):
         """
-        Processa uma foto de forma assíncrona
+        Processa uma foto de forma assíncrona, com a análise no executor de CPU
         """
         try:
-            # Carregar imagem
-            img_pil = Image.open(photo.file_path)
-            img_np = np.array(img_pil)  # Converte para numpy array
-
-            # Converte para BGR para ficar compativel com insightface
-            img = img_np[:, :, ::-1].copy()
-            
-            # Detectar faces (esta parte roda na thread do pool)
-            faces = self.app.get(img)
-
-            if(len(faces) > 0):
-                # Definir o caminho das faces
-                original_path = Path(photo.file_path)
-                face_dir = original_path.parent / "faces"
-
-                # Criar diretório de faces se não existir
-                face_dir.mkdir(exist_ok=True)
-
-                # Processar faces detectadas
-                for face in faces:
-                    # Salvar face no banco de dados
-                    face_record = await Face.create(
-                        data={
-                            "bbox": face.bbox.tolist(),
-                            "landmark": face.landmark.tolist() if face.landmark is not None else None,
-                            "gender": int(face.gender) if hasattr(face, "gender") else None,
-                            "age": int(face.age) if hasattr(face, "age") else None,
-                            "embedding": face.embedding.tolist() if hasattr(face, "embedding") else None,
-                            "score": float(face.det_score),
-                        },
-                        user_id=photo.user_id,
-                        photo_id=photo.id,
-                    )
-                    
-                    face_path = await face_record.get_face_path()
-
-                    x1, y1, x2, y2 = face.bbox.astype(int)
-            
-                    # Cortar o rosto da imagem original
-                    face_img = img_pil.crop((x1, y1, x2, y2))
-                    
-                    # Salvar a imagem do rosto na pasta local
-                    face_img.save(face_path, optimize=True)
-
-                    logger_info(__name__, f'Face {face_record.id} salva em {face_path}')
-                    
-                    photo.face_count += 1
-
-            photo.is_indexed = True
-            await photo.save()
+            # Uma foto com o mesmo conteúdo já analisada tem suas faces copiadas
+            cached = await AnalysisCache.lookup([photo], self.model_version)
+            if photo.id in cached:
+                faces = cached[photo.id]
+            else:
+                faces = await CpuExecutor.shared().run('analyze', self.analyze, photo.file_path, True)
+            await FaceWriter.write([(photo, faces)], self.model_version)
+            logger_info(__name__, f'{len(faces)} face(s) salva(s) da foto {photo.id}')
             return photo
-            
+
+        except CpuExecutorSaturated:
+            raise
         except Exception as e:
             logger_error(__name__, e)
             return photo  # Retorna a foto mesmo com erro para continuar o processamento
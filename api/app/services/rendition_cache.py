@@ -0,0 +1,147 @@
+import os
+import glob
+import asyncio
+import threading
+from app.services.renditions import Renditions
+from app.services.cpu_executor import CpuExecutor
+from app.utils import logger_info, logger_error
+
+class RenditionCache:
+    """
+    Cache em disco das versões reduzidas geradas sob demanda (fotos sem as versões da indexação).
+    Os arquivos são identificados pelo id da foto, tamanho e formato e, ao ultrapassar o limite de
+    disco, os usados há mais tempo (data de modificação, atualizada a cada uso) são removidos.
+    A data é marcada pelo próprio cache, sem depender do registro de acesso do sistema de arquivos
+    (noatime/relatime); por isso o ETag vem da foto original e da configuração (ver `get_version`).
+    Requisições simultâneas da mesma versão aguardam uma única geração.
+    """
+    root = '/app/files/cache/renditions'
+    max_size = int(os.getenv("RENDITION_CACHE_MB", 1024)) * 1024 * 1024  # Limite de disco do cache
+    target_ratio = 0.9  # A remoção libera espaço até esta fração do limite
+
+    _size = None  # Tamanho ocupado estimado (recalculado a cada remoção)
+    _pending = {}  # Caminho -> geração em andamento
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_path(cls, photo_id: int, name: str) -> str:
+        size = Renditions.sizes[name]
+        extension = Renditions.formats[Renditions.image_format][0]
+        return f"{cls.root}/{photo_id}_{size}.{extension}"
+
+    @classmethod
+    async def get(cls, photo_id: int, file_path: str, name: str) -> str:
+        """
+        Retorna o caminho da versão no cache, gerando-a uma única vez caso não exista
+
+        Args:
+            photo_id (int): Id da foto
+            file_path (str): Caminho da foto original
+            name (str): Nome da versão
+        Returns:
+            str: Caminho da versão
+        """
+        if name not in Renditions.sizes:
+            raise ValueError(f"Versão '{name}' inválida. Opções: {', '.join(Renditions.sizes)}")
+
+        path = cls.get_path(photo_id, name)
+        try:
+            # Marca o uso para a ordem de remoção
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+
+        task = cls._pending.get(path)
+        if task is None:
+            task = asyncio.ensure_future(CpuExecutor.shared().run('rendition', cls.build, file_path, name, path))
+            cls._pending[path] = task
+            task.add_done_callback(lambda _: cls._pending.pop(path, None))
+
+        # Uma requisição cancelada não interrompe a geração aguardada pelas demais
+        return await asyncio.shield(task)
+
+    @staticmethod
+    def get_version(file_path: str, name: str) -> tuple:
+        """
+        Identifica o conteúdo da versão sem depender do arquivo no cache, que é tocado a cada uso
+        e pode ser removido e gerado novamente
+
+        Returns:
+            tuple: (ETag, data de modificação) da foto original com o tamanho, formato e qualidade da versão
+        """
+        stat = os.stat(file_path)
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}-{Renditions.sizes[name]:x}-{Renditions.image_format.lower()}{Renditions.quality}"'
+        return etag, stat.st_mtime
+
+    @classmethod
+    def build(cls, file_path: str, name: str, path: str) -> str:
+        """
+        Gera a versão no cache e remove as mais antigas caso o limite seja ultrapassado
+        """
+        Renditions.build(file_path, name, path)
+
+        with cls._lock:
+            if cls._size is None:
+                cls._size = cls.usage()[0]
+            else:
+                cls._size += os.path.getsize(path)
+
+            if cls._size > cls.max_size:
+                cls.evict(keep=path)
+        return path
+
+    @classmethod
+    def usage(cls) -> tuple:
+        """
+        Returns:
+            tuple: (tamanho total em bytes, lista de (data do último uso, tamanho, caminho))
+        """
+        entries = []
+        if os.path.exists(cls.root):
+            for entry in os.scandir(cls.root):
+                if entry.is_file() and '.tmp-' not in entry.name:
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return sum(entry[1] for entry in entries), entries
+
+    @classmethod
+    def evict(cls, keep: str = None):
+        """
+        Remove as versões usadas há mais tempo até liberar espaço
+
+        Args:
+            keep (str, optional): Versão que não deve ser removida (ex.: a que acabou de ser gerada)
+        """
+        total, entries = cls.usage()
+        target = cls.max_size * cls.target_ratio
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger_error(__name__, e)
+
+        cls._size = total
+        logger_info(__name__, f'{removed} versão(ões) removida(s) do cache ({total / 1024 / 1024:.1f} MB em uso)')
+
+    @classmethod
+    def remove(cls, photo_id: int):
+        """
+        Remove as versões da foto do cache
+        """
+        for path in glob.glob(f"{cls.root}/{photo_id}_*"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger_error(__name__, e)
@@ -0,0 +1,123 @@
+import os
+import threading
+from PIL import Image, ImageOps
+from app.utils import logger_error
+
+class Renditions:
+    """
+    Versões reduzidas das fotos (miniatura da galeria e imagem do visualizador).
+    São geradas na indexação a partir da imagem já decodificada para a detecção e gravadas
+    na pasta `renditions` ao lado da foto; as que faltarem são geradas sob demanda no `RenditionCache`.
+    """
+    # Versões no formato nome:maior lado (ex.: "thumbnail:300,scaled:1280")
+    sizes = {
+        name: int(size)
+        for name, size in (
+            item.split(':') for item in os.getenv("PHOTO_RENDITIONS", "thumbnail:300,scaled:1280").split(',') if item
+        )
+    }
+    image_format = os.getenv("PHOTO_RENDITION_FORMAT", "WEBP").upper()  # WEBP ou JPEG
+    quality = int(os.getenv("PHOTO_RENDITION_QUALITY", 80))
+    formats = {
+        'WEBP': ('webp', 'image/webp'),
+        'JPEG': ('jpg', 'image/jpeg'),
+    }
+
+    if image_format not in formats:
+        raise ValueError("A variável de ambiente PHOTO_RENDITION_FORMAT deve ser WEBP ou JPEG.")
+
+    @classmethod
+    def get_media_type(cls) -> str:
+        return cls.formats[cls.image_format][1]
+
+    @classmethod
+    def get_path(cls, file_path: str, name: str) -> str:
+        """
+        Caminho da versão `name` da foto
+        """
+        directory, file_name = os.path.split(file_path)
+        stem, _ = os.path.splitext(file_name)
+        return os.path.join(directory, 'renditions', f"{stem}_{name}.{cls.formats[cls.image_format][0]}")
+
+    @classmethod
+    def write(cls, img: Image.Image, path: str):
+        """
+        Codifica a imagem no formato das versões, gravando com nome temporário e renomeando ao final
+        """
+        # Transparência é mantida apenas no WebP
+        if img.mode != 'RGB' and not (img.mode == 'RGBA' and cls.image_format == 'WEBP'):
+            img = img.convert('RGB')
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        try:
+            img.save(temp_path, format=cls.image_format, quality=cls.quality)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    @classmethod
+    def save(cls, img: Image.Image, file_path: str) -> list:
+        """
+        Grava todas as versões da foto a partir de uma imagem já decodificada (e orientada).
+        A imagem deve ter pelo menos o tamanho da maior versão para não perder resolução.
+
+        Args:
+            img (Image): Imagem decodificada
+            file_path (str): Caminho da foto original
+        Returns:
+            list: Caminhos das versões gravadas
+        """
+        saved = []
+        # Da maior para a menor: cada versão é reduzida a partir da anterior
+        for name in sorted(cls.sizes, key=lambda name: cls.sizes[name], reverse=True):
+            size = cls.sizes[name]
+            if max(img.size) > size:
+                img = img.copy()
+                img.thumbnail((size, size))
+
+            path = cls.get_path(file_path, name)
+            cls.write(img, path)
+            saved.append(path)
+
+        return saved
+
+    @classmethod
+    def build(cls, file_path: str, name: str, path: str) -> str:
+        """
+        Gera uma versão a partir da foto original
+
+        Args:
+            file_path (str): Caminho da foto original
+            name (str): Nome da versão
+            path (str): Caminho onde a versão é gravada
+        Returns:
+            str: Caminho da versão gerada
+        """
+        if name not in cls.sizes:
+            raise ValueError(f"Versão '{name}' inválida. Opções: {', '.join(cls.sizes)}")
+
+        size = cls.sizes[name]
+        with Image.open(file_path) as img:
+            # JPEGs são reduzidos na própria decodificação
+            if img.format == 'JPEG':
+                img.draft('RGB', (size, size))
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((size, size))
+            cls.write(img, path)
+        return path
+
+    @classmethod
+    def remove(cls, file_path: str):
+        """
+        Remove as versões da foto
+        """
+        for name in cls.sizes:
+            path = cls.get_path(file_path, name)
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except Exception as e:
+                logger_error(__name__, e)
@@ -0,0 +1,310 @@
+import os
+import time
+import numpy as np
+from typing import Optional
+from tortoise import connections, transactions
+from app.models.face import Face
+from app.models.search import Search, SearchMode
+from app.models.search_face import SearchFace
+from app.services.embedding import decode_embedding
+from app.services.face_reader import FaceReader
+from app.services.face_index import FaceIndex
+from app.utils import logger_info, logger_error
+
+class SearchEngine:
+    """
+    Motor de busca vetorizado.
+    Carrega a face de referência uma única vez e consulta o índice aproximado de cada coleção.
+    Sem índice, lê os embeddings candidatos em lotes de tamanho fixo e calcula as similaridades
+    de cada lote com um único produto matriz-vetor.
+    Todas as candidatas acima de `score_floor` ficam guardadas, permitindo trocar a tolerância sem nova busca.
+    No modo top-k a pesquisa retorna as K faces mais semelhantes em vez de usar a tolerância.
+    """
+    batch_size = 1000
+    exact = os.getenv("SEARCH_EXACT", "0") == "1"  # Ignora os índices aproximados
+    # Similaridade mínima guardada nos resultados da pesquisa: mudanças de tolerância acima
+    # deste valor apenas filtram os resultados guardados, sem uma nova busca
+    score_floor = float(os.getenv("SEARCH_SCORE_FLOOR", 0.10))
+    max_top_k = int(os.getenv("SEARCH_MAX_TOP_K", 10000))
+
+    def __init__(self, search: Search):
+        self.search = search
+
+    @property
+    def threshold(self) -> float:
+        return float(self.search.tolerance_level * 0.01)
+
+    @property
+    def top_k(self) -> Optional[int]:
+        """
+        Quantidade de faces mais semelhantes retornadas no modo top-k (None no modo por tolerância)
+        """
+        if self.search.mode != SearchMode.TOP_K:
+            return None
+        return min(max(1, int(self.search.top_k or 1)), self.max_top_k)
+
+    @property
+    def scan_threshold(self) -> float:
+        """
+        Limiar usado na busca: o menor entre a tolerância atual e o piso dos resultados guardados
+        """
+        if self.top_k:
+            return self.score_floor
+        return min(self.threshold, self.score_floor)
+
+    @property
+    def scores_path(self) -> str:
+        return f"/app/files/search/{self.search.id}/scores.npz"
+
+    @staticmethod
+    def score(matrix: np.ndarray, reference: np.ndarray) -> np.ndarray:
+        """
+        Calcula a similaridade de cosseno de todas as faces candidatas com a referência
+        """
+        return matrix @ reference
+
+    async def load_reference(self) -> np.ndarray:
+        """
+        Retorna o embedding normalizado da face de referência da pesquisa
+        """
+        reference_face = await Face.filter(
+            photo__owner_id=self.search.id,
+            photo__owner_type="search"
+        ).first()
+
+        if not reference_face or not reference_face.embedding:
+            raise Exception(f'Face de referência da pesquisa {self.search.id} não encontrada')
+
+        return decode_embedding(reference_face.embedding).astype(np.float32)
+
+    def match(self, face_ids: np.ndarray, photo_ids: np.ndarray, matrix: np.ndarray, reference: np.ndarray):
+        """
+        Compara a referência com todas as faces da matriz e filtra pelo limiar de tolerância
+        """
+        if not len(face_ids):
+            return face_ids, photo_ids, np.empty(0, dtype=np.float32)
+
+        similarities = self.score(matrix, reference)
+        matches = np.flatnonzero(similarities >= self.scan_threshold)
+        return face_ids[matches], photo_ids[matches], similarities[matches]
+
+    async def scan(self, reader: FaceReader, reference: np.ndarray):
+        """
+        Compara a referência com as faces lidas lote a lote, guardando apenas as encontradas
+
+        Returns:
+            tuple: (ids das faces, ids das fotos, similaridades) encontradas
+            int: Quantidade de faces consideradas
+        """
+        results = [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))]
+        scanned = 0
+        async for face_ids, photo_ids, matrix in reader.batches():
+            results.append(self.match(face_ids, photo_ids, matrix, reference))
+            scanned += len(face_ids)
+        return tuple(np.concatenate(values) for values in zip(*results)), scanned
+
+    async def search_collection(self, collection_id: int, reference: np.ndarray):
+        """
+        Busca na coleção usando seu índice aproximado. Sem índice (ou com SEARCH_EXACT=1)
+        a busca é feita por força bruta, em lotes, sobre os embeddings do banco.
+
+        Returns:
+            tuple: (ids das faces, ids das fotos, similaridades) encontradas
+            int: Quantidade de faces consideradas
+        """
+        index = None if self.exact else FaceIndex.load(collection_id)
+        if index is None:
+            return await self.scan(FaceReader([collection_id]), reference)
+
+        # Faces gravadas depois da última atualização do índice são comparadas diretamente
+        delta, scanned = await self.scan(FaceReader([collection_id], index.max_face_id), reference)
+        results = [index.search(reference, self.scan_threshold), delta]
+        return tuple(np.concatenate(values) for values in zip(*results)), index.size + scanned
+
+    @staticmethod
+    def sort_scores(face_ids: np.ndarray, photo_ids: np.ndarray, similarities: np.ndarray) -> tuple:
+        """
+        Ordena as candidatas da mais para a menos semelhante
+        """
+        order = np.argsort(-similarities, kind='stable')
+        return face_ids[order], photo_ids[order], similarities[order]
+
+    def save_scores(self, face_ids: np.ndarray, photo_ids: np.ndarray, similarities: np.ndarray):
+        """
+        Guarda todas as faces candidatas acima do piso, ordenadas por similaridade, em um arquivo compacto da pesquisa
+        """
+        temp_path = f"{self.scores_path}.tmp-{os.getpid()}.npz"
+        os.makedirs(os.path.dirname(self.scores_path), exist_ok=True)
+        np.savez(
+            temp_path,
+            face_ids=face_ids.astype(np.int64),
+            photo_ids=photo_ids.astype(np.int64),
+            similarities=similarities.astype(np.float32),
+            floor=np.float32(self.scan_threshold)
+        )
+        os.replace(temp_path, self.scores_path)
+
+    def load_scores(self):
+        """
+        Carrega os resultados guardados caso eles cubram a tolerância atual
+
+        Returns:
+            tuple: (ids das faces, ids das fotos, similaridades), da mais para a menos semelhante,
+                ou None quando é necessária uma nova busca
+        """
+        if not os.path.exists(self.scores_path):
+            return None
+
+        try:
+            with np.load(self.scores_path) as scores:
+                # O modo top-k usa sempre as melhores candidatas guardadas; o modo por tolerância
+                # precisa que o piso guardado não seja maior que o limiar
+                if not self.top_k and float(scores['floor']) > self.threshold + 1e-6:
+                    return None
+                face_ids, photo_ids, similarities = scores['face_ids'], scores['photo_ids'], scores['similarities']
+
+            # Arquivos gravados antes da ordenação
+            if len(similarities) > 1 and (np.diff(similarities) > 0).any():
+                return self.sort_scores(face_ids, photo_ids, similarities)
+            return face_ids, photo_ids, similarities
+        except Exception as e:
+            logger_error(__name__, e)
+            return None
+
+    def rank(self, similarities: np.ndarray, presorted: bool = False) -> np.ndarray:
+        """
+        Seleciona as candidatas do modo atual (acima da tolerância ou as K mais semelhantes)
+
+        Args:
+            similarities (np.ndarray): Similaridades das candidatas
+            presorted (bool): As similaridades já estão em ordem decrescente: a seleção é um prefixo
+        Returns:
+            np.ndarray: Posições das candidatas selecionadas, da mais para a menos semelhante
+        """
+        top_k = self.top_k
+        if presorted:
+            if top_k:
+                return np.arange(min(top_k, len(similarities)))
+            return np.arange(np.searchsorted(-similarities, -self.threshold, side='right'))
+
+        if top_k:
+            # Ordenação parcial: apenas as K melhores são ordenadas
+            if top_k < len(similarities):
+                selected = np.argpartition(-similarities, top_k - 1)[:top_k]
+            else:
+                selected = np.arange(len(similarities))
+        else:
+            selected = np.flatnonzero(similarities >= self.threshold)
+
+        return selected[np.argsort(-similarities[selected], kind='stable')]
+
+    async def apply_tolerance(self, face_ids: np.ndarray, photo_ids: np.ndarray, similarities: np.ndarray) -> int:
+        """
+        Vincula à pesquisa apenas as faces selecionadas pelo modo atual, em ordem de
+        similaridade, removendo as que deixaram de ser selecionadas.
+        As candidatas devem estar ordenadas (ver `sort_scores`).
+
+        Returns:
+            int: Quantidade de registros criados
+        """
+        selected = self.rank(similarities, presorted=True)
+        async with transactions.in_transaction() as conn:
+            # Ajustes simultâneos da mesma pesquisa (nova tolerância ou busca em andamento) são serializados
+            await Search.filter(id=self.search.id).using_db(conn).select_for_update().first()
+
+            # A seleção usa as similaridades exatas: a gravada no banco é arredondada e não serve de filtro
+            await SearchFace.filter(search_id=self.search.id).using_db(conn).exclude(face_id__in=face_ids[selected].tolist()).delete()
+            return await self.save_matches(face_ids[selected], photo_ids[selected], similarities[selected], conn)
+
+    async def retune(self) -> Optional[int]:
+        """
+        Aplica uma nova tolerância (ou um novo K) filtrando os resultados guardados, sem comparar as faces novamente
+
+        Returns:
+            int: Quantidade de registros criados ou None quando os resultados guardados não cobrem a tolerância
+        """
+        try:
+            started_at = time.perf_counter()
+            scores = self.load_scores()
+            if scores is None:
+                return None
+
+            created = await self.apply_tolerance(*scores)
+            criteria = f'top {self.top_k}' if self.top_k else f'tolerância {self.search.tolerance_level}'
+            logger_info(__name__, f'Pesquisa {self.search.id}: {criteria} aplicado em {time.perf_counter() - started_at:.3f}s')
+            return created
+        except Exception as e:
+            logger_error(__name__, e)
+            raise
+
+    async def save_matches(self, face_ids: np.ndarray, photo_ids: np.ndarray, similarities: np.ndarray, conn=None) -> int:
+        """
+        Persiste as faces encontradas em lotes. Vínculos já existentes são ignorados pela
+        restrição única (search_id, face_id), o que mantém novas execuções idempotentes, e faces
+        removidas depois da busca (ids ainda presentes em um índice ou nos resultados guardados) são descartadas.
+
+        Args:
+            conn (optional): Conexão da transação em andamento
+        Returns:
+            int: Quantidade de registros criados
+        """
+        conn = conn or connections.get("default")
+        created = 0
+        for start in range(0, len(face_ids), self.batch_size):
+            end = start + self.batch_size
+            _, rows = await conn.execute_query("""
+                INSERT INTO search_faces (search_id, user_id, face_id, photo_id, similarity, created_at, updated_at)
+                SELECT $1, $2, matches.face_id, matches.photo_id, matches.similarity, now(), now()
+                FROM unnest($3::int[], $4::int[], $5::float8[]) AS matches(face_id, photo_id, similarity)
+                JOIN faces ON faces.id = matches.face_id
+                ON CONFLICT (search_id, face_id) DO NOTHING
+                RETURNING id
+            """, [
+                self.search.id,
+                self.search.user_id,
+                face_ids[start:end].tolist(),
+                photo_ids[start:end].tolist(),
+                np.round(similarities[start:end].astype(np.float64), 2).tolist()
+            ])
+            created += len(rows)
+
+        return created
+
+    async def run(self, progress=None) -> int:
+        """
+        Executa a pesquisa e retorna a quantidade de novas faces vinculadas
+
+        Args:
+            progress (ProgressReporter, optional): Progresso por coleção pesquisada
+        """
+        try:
+            started_at = time.perf_counter()
+            reference = await self.load_reference()
+
+            results = []
+            candidates = 0
+            for collection_id in self.search.collections:
+                result, total = await self.search_collection(collection_id, reference)
+                results.append(result)
+                candidates += total
+                if progress:
+                    await progress.update(done=1, faces=len(result[0]))
+
+            if not results:
+                return 0
+
+            face_ids, photo_ids, similarities = self.sort_scores(*(np.concatenate(values) for values in zip(*results)))
+            scored_at = time.perf_counter()
+
+            self.save_scores(face_ids, photo_ids, similarities)
+            created = await self.apply_tolerance(face_ids, photo_ids, similarities)
+
+            logger_info(
+                __name__,
+                f'Pesquisa {self.search.id}: {candidates} face(s) comparada(s), {len(face_ids)} acima do piso, {created} nova(s) '
+                f'(busca {scored_at - started_at:.3f}s, gravação {time.perf_counter() - scored_at:.3f}s)'
+            )
+            return created
+        except Exception as e:
+            logger_error(__name__, e)
+            raise
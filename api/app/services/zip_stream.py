@@ -0,0 +1,84 @@
+import os
+import asyncio
+import zipfile
+from app.utils import logger_error
+
+class ZipBuffer:
+    """
+    Saída não posicionável do ZipFile: acumula os bytes escritos até serem enviados ao cliente.
+    Sem `seek`/`tell` o ZipFile grava cada arquivo com descritor de dados, sem voltar ao cabeçalho.
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+class ZipStream:
+    """
+    Gera um arquivo ZIP em streaming: o cabeçalho e os dados de cada foto são enviados à medida que
+    ela é lida, sem montar o arquivo em memória. Formatos já comprimidos são armazenados sem compressão
+    e o ZIP64 é usado quando os tamanhos ou a quantidade de arquivos ultrapassam os limites do ZIP.
+    O próximo bloco só é lido quando o cliente consome o anterior.
+    """
+    chunk_size = int(os.getenv("ZIP_STREAM_CHUNK_KB", 1024)) * 1024
+    stored_extensions = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.heic')  # Já comprimidos
+
+    @classmethod
+    def get_compress_type(cls, name: str) -> int:
+        return zipfile.ZIP_STORED if name.lower().endswith(cls.stored_extensions) else zipfile.ZIP_DEFLATED
+
+    @staticmethod
+    def get_arcname(name: str, used: set) -> str:
+        """
+        Nome do arquivo no ZIP, numerado quando já existe outro com o mesmo nome
+        """
+        stem, extension = os.path.splitext(name)
+        arcname, counter = name, 1
+        while arcname in used:
+            arcname = f"{stem} ({counter}){extension}"
+            counter += 1
+        used.add(arcname)
+        return arcname
+
+    @classmethod
+    async def stream(cls, files: list):
+        """
+        Args:
+            files (list): Tuplas (caminho do arquivo, nome no ZIP)
+        Yields:
+            bytes: Partes do arquivo ZIP
+        """
+        buffer = ZipBuffer()
+        used = set()
+        with zipfile.ZipFile(buffer, 'w', allowZip64=True) as zip_file:
+            for file_path, name in files:
+                try:
+                    # Data e tamanho vêm do arquivo; o tamanho define o uso de ZIP64 na entrada
+                    zinfo = zipfile.ZipInfo.from_file(file_path, cls.get_arcname(name, used), strict_timestamps=False)
+                    zinfo.compress_type = cls.get_compress_type(name)
+                    source = open(file_path, 'rb')
+                except Exception as e:
+                    logger_error(__name__, e)
+                    continue
+
+                with source, zip_file.open(zinfo, 'w') as target:
+                    while chunk := await asyncio.to_thread(source.read, cls.chunk_size):
+                        target.write(chunk)
+                        if data := buffer.drain():
+                            yield data
+
+                # Descritor de dados da entrada
+                yield buffer.drain()
+
+        # Diretório central
+        yield buffer.drain()
@@ -1,4 +1,5 @@
-from celery import Celery
+from celery import Celery, chord, group
+from celery.signals import worker_process_init, worker_ready
 import os
 import zipfile
 from app.models.archive import Archive
@@ -8,12 +9,17 @@ from app.models.job import Job, JobStatus
 from app.models.face import Face
 from app.models.search import Search,SearchStatus
 from app.models.search_face import SearchFace
-from app.utils import logger_info, logger_error, execute_raw_sql,chunk_array
-import shutil
+from app.utils import logger_info, logger_error, execute_raw_sql,chunk_array,extract_zip_member
 import asyncio
 from app.config import init_db, close_db
-from concurrent.futures import ThreadPoolExecutor
+from app import migrations
 from app.services.recognition import Recognition
+from app.services.search_engine import SearchEngine
+from app.services.face_index import FaceIndex, update_collection_index
+from app.services.indexation import IndexationPool
+from app.services.progress import ProgressReporter
+from app.services.renditions import Renditions
+from app.services.rendition_cache import RenditionCache
 from app.services.sse_manager import sse_manager
 
 # Configuração do Celery
@@ -32,8 +38,32 @@ celery_app.conf.update(
     enable_utc=True,
     task_acks_late=True,
     task_reject_on_worker_lost=True,
+    # A indexação cria seu próprio pool de processos e precisa de um worker que não seja
+    # um processo filho do prefork (ex.: celery worker -P solo -Q indexation)
+    task_routes={
+        'app.tasks.collection_uncompression': {'queue': 'indexation'},
+        'app.tasks.collection_indexation_chunk': {'queue': 'indexation'},
+    },
+    # Tarefas longas: cada worker reserva apenas a próxima tarefa, deixando as demais para outros nós
+    worker_prefetch_multiplier=1,
 )
 
+@worker_process_init.connect
+def preload_recognition(**kwargs):
+    """
+    Carrega o modelo uma única vez em cada processo do worker (pool prefork)
+    """
+    if Recognition.preload:
+        Recognition.get_instance()
+
+@worker_ready.connect
+def preload_indexation_pool(**kwargs):
+    """
+    Inicia o pool de indexação (com um modelo por processo) quando o worker fica disponível
+    """
+    if IndexationPool.preload:
+        IndexationPool.shared().warm_up()
+
 async def wrap_db_ctx(func, *args, **kwargs):
     try:
         await init_db()
@@ -45,8 +75,8 @@ async def wrap_db_ctx(func, *args, **kwargs):
     finally:
         await close_db()
 
-def async_to_sync(func, *args, **kwargs) -> None:
-    asyncio.run(wrap_db_ctx(func, *args, **kwargs))
+def async_to_sync(func, *args, **kwargs):
+    return asyncio.run(wrap_db_ctx(func, *args, **kwargs))
 
 async def check_job(job_id):
     job = await Job.get_or_none(id=job_id)
@@ -54,6 +84,70 @@ async def check_job(job_id):
         raise Exception("Job não encontrado")
     return job
 
+def collection_progress(collection: Collection) -> ProgressReporter:
+    return ProgressReporter('collections', collection.id, collection.user_id, f'Indexando coleção {collection.name}')
+
+async def remove_replaced_photos(collection: Collection):
+    """
+    Remove as versões anteriores das fotos substituídas na coleção, depois que as novas versões
+    foram indexadas (ver Photo.REPLACED_OWNER_TYPE)
+    """
+    replaced_photos = await Photo.filter(
+        owner_id=collection.id,
+        owner_type=Photo.REPLACED_OWNER_TYPE
+    ).values_list('id', 'file_path')
+
+    for chunk in chunk_array(replaced_photos, 100):
+        photo_ids = []
+        for photo_id, file_path in chunk:
+            photo_ids.append(photo_id)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            Renditions.remove(file_path)
+            RenditionCache.remove(photo_id)
+
+        await Photo.filter(id__in=photo_ids).delete()
+
+    if replaced_photos:
+        logger_info(__name__, f'{len(replaced_photos)} versão(ões) anterior(es) de foto(s) removida(s) da coleção {collection.id}')
+
+async def finish_collection_indexation(collection: Collection):
+    """
+    Conclui a indexação de uma coleção: atualiza o índice aproximado, o status e notifica o usuário
+    """
+    await collection_progress(collection).finish()
+
+    # Cria ou estende o índice aproximado da coleção
+    await update_collection_index(collection.id)
+
+    await remove_replaced_photos(collection)
+
+    # Query para contar as faces de fotos
+    face_counter_query = f"""
+        SELECT COUNT(faces.id) FROM faces
+        INNER JOIN photos ON photos.id=faces.photo_id
+        WHERE
+            photos.owner_id={collection.id} AND
+            photos.owner_type='collection' AND
+            photos.is_indexed=true
+    """
+    
+    # Executar contagem total
+    face_counter = await execute_raw_sql(face_counter_query)
+    face_counter = face_counter[0]["count"] if face_counter else 0
+    collection.status = CollectionStatus.FINISHED
+    await collection.save()
+
+    await sse_manager.publish(
+        collection.user_id,
+        {
+            'entity':'collections', 
+            'id': collection.id,
+            'message': f'Coleção {collection.name} indexada com sucesso: {face_counter} faces encontradas'
+        },
+        'collection_indexation'
+    )
+
 @celery_app.task(bind=True,max_retries=0)
 def retry_failed_tasks(self):
     """
@@ -105,18 +199,30 @@ def check_downloaded_model(self):
     except Exception as e:
         self.retry(exc=e)
 
+@celery_app.task(bind=True,max_retries=0)
+def migrate_face_embeddings(self):
+    """
+    Converte os embeddings das faces gravados em JSON para o formato binário
+    """
+    try:
+        async_to_sync(migrations.migrate_face_embeddings)
+    except Exception as e:
+        logger_error(__name__, e)
+        raise
+
 @celery_app.task(bind=True,max_retries=0)
 def collection_uncompression(self, job_id):
     """
-    Descompacta um arquivo e move as imagens para o diretório de imagens da coleção.
+    Extrai as imagens de um arquivo direto para o diretório da coleção e as indexa em lotes
+    enquanto a extração continua. Ao final, as fotos restantes são indexadas em partes.
     """
     try:
         async def __action__():
-            temp_dir = None
+            indexer = None
+            indexation_job = None
             try:
                 nonlocal job_id
                 job = await check_job(job_id)
-                temp_dir = f'/app/files/temp/{job.owner_id}'
                 archive = await Archive.get_or_none(id=job.owner_id)
                 if not archive:
                     raise Exception("Arquivo não encontrado")
@@ -131,74 +237,86 @@ def collection_uncompression(self, job_id):
                 }
 
                 photos_to_remove = []
-
-                os.makedirs(temp_dir, exist_ok=True)
                 added_photos_counter = 0
 
-                with zipfile.ZipFile(archive.file_path, 'r') as zip_ref:
-                    zip_ref.extractall(temp_dir)
+                progress = collection_progress(collection)
+                await progress.start(job_id=job.id)
+
+                # Os lotes de fotos extraídas são indexados em paralelo com a extração
+                batches = asyncio.Queue()
+                indexer = asyncio.create_task(IndexationPool.shared().index_batches(batches, progress))
+                batch = []
 
-                for item in os.scandir(temp_dir):
-                    if not item.is_file():
-                        continue
+                with zipfile.ZipFile(archive.file_path, 'r') as zip_ref:
+                    for member in zip_ref.infolist():
+                        # Apenas arquivos da raiz do arquivo compactado
+                        if member.is_dir() or '/' in member.filename:
+                            continue
+
+                        _, ext = os.path.splitext(member.filename.lower())
+                        if ext not in ['.jpg', '.jpeg', '.png']:
+                            continue
                         
-                    _, ext = os.path.splitext(item.name.lower())
-                    if ext not in ['.jpg', '.jpeg', '.png']:
-                        os.remove(item.path)
-                        continue
-                    
-                    has_photo = photo_references.get(item.name)
-
-                    # Verifica se a foto já existe na coleção adiciona a versão anterior na lista de remoção
-                    if has_photo:
-
-                        # Caso a foto para remoção seja a thumbnail da coleção, remove a referência
-                        if(collection.thumbnail_photo_id==has_photo[0]):
-                            collection.thumbnail_photo_id = None
-                            collection.save()
+                        has_photo = photo_references.get(member.filename)
+
+                        # Verifica se a foto já existe na coleção adiciona a versão anterior na lista de remoção
+                        if has_photo:
+
+                            # Caso a foto para remoção seja a thumbnail da coleção, remove a referência
+                            if(collection.thumbnail_photo_id==has_photo[0]):
+                                collection.thumbnail_photo_id = None
+                                await collection.save()
+                            
+                            photos_to_remove.append(has_photo)
+
+                        # Extrai cada foto direto para o caminho final
+                        photo = await Photo.create_file(collection, member.filename, member.file_size)
+                        try:
+                            photo.content_hash = await asyncio.to_thread(extract_zip_member, zip_ref, member, photo.file_path)
+                            await Photo.filter(id=photo.id).update(content_hash=photo.content_hash)
+                        except Exception:
+                            await photo.delete()
+                            raise
+
+                        # Atualiza a coleção com a foto adicionada caso ainda não tenha uma foto de destaque
+                        if not collection.thumbnail_photo_id:
+                            collection.thumbnail_photo_id = photo.id
                         
-                        photos_to_remove.append(has_photo)
-
-                    # Processa cada foto
-                    photo = await Photo.create_file(collection, item.name, item.stat().st_size)
-
-                    # Atualiza a coleção com a foto adicionada caso ainda não tenha uma foto de destaque
-                    if not collection.thumbnail_photo:
-                        collection.thumbnail_photo = photo
-                    
-                    shutil.move(item.path, photo.file_path)
-                    added_photos_counter += 1
+                        added_photos_counter += 1
+                        batch.append(photo)
+                        if len(batch) >= IndexationPool.batch_size:
+                            batches.put_nowait(batch)
+                            batch = []
+                            await progress.set_total(added_photos_counter)
+
+                if batch:
+                    batches.put_nowait(batch)
                 
-                # Caso existam arquivos para remoção executa a remoção
+                # As versões anteriores das fotos substituídas saem da coleção, mas só são removidas ao fim
+                # da indexação: até lá as novas versões reaproveitam as faces delas (AnalysisCache)
                 if(photos_to_remove):
-                    chunks = chunk_array(photos_to_remove, 100)
-                    for chunk in chunks:
-                        photo_ids = []
-                        
-                        for photo_params in chunk:
-                            photo_ids.append(photo_params[0])
-                            os.remove(photo_params[1])
-
-                        await Photo.filter(id__in=photo_ids).delete()
+                    # O índice contém faces das fotos removidas e será recriado na indexação
+                    FaceIndex.invalidate(collection.id)
+                    for chunk in chunk_array(photos_to_remove, 100):
+                        await Photo.filter(id__in=[photo_params[0] for photo_params in chunk]).update(owner_type=Photo.REPLACED_OWNER_TYPE)
 
                 # Atualiza coleção
                 collection.status = CollectionStatus.INDEXING
                 collection.photo_quantity = added_photos_counter
                 await collection.save()
 
-                # Cria novo job para indexação
+                # Job de indexação: caso a indexação em andamento falhe, ele é reexecutado
                 indexation_job = await Job.create(
                     process_type="collection_indexation",
                     owner_type="collection",
-                    owner_id=collection.id
+                    owner_id=collection.id,
+                    status=JobStatus.IN_PROGRESS
                 )
-
-                collection_indexation.delay(indexation_job.id)
+                await progress.set_total(added_photos_counter, indexation_job.id)
 
                 # Limpeza final
                 os.remove(archive.file_path)
                 await archive.delete()
-                shutil.rmtree(temp_dir)
                 await job.delete()
 
                 await sse_manager.publish(
@@ -213,10 +331,22 @@ def collection_uncompression(self, job_id):
 
                 logger_info(__name__, f'{added_photos_counter} foto(s) adicionada(s) à coleção {collection.id}')
 
+                # Os lotes ainda não iniciados são distribuídos entre todos os workers pela
+                # indexação em partes, que também conclui a coleção
+                while not batches.empty():
+                    batches.get_nowait()
+                batches.put_nowait(None)
+                await indexer
+
+                collection_indexation.delay(indexation_job.id)
+
             except Exception as e:
                 logger_error(__name__, e)
-                if temp_dir and os.path.exists(temp_dir):
-                    shutil.rmtree(temp_dir, ignore_errors=True)
+                if indexer and not indexer.done():
+                    indexer.cancel()
+                if indexation_job:
+                    indexation_job.status = JobStatus.FAILED
+                    await indexation_job.save()
                 raise
         async_to_sync(__action__)
     except Exception as e:
@@ -226,7 +356,8 @@ def collection_uncompression(self, job_id):
 @celery_app.task(bind=True,max_retries=0)
 def collection_indexation(self, job_id):
     """
-    Indexa as imagens de uma coleção usando processamento paralelo
+    Divide a indexação das imagens de uma coleção em partes (intervalos de ids) executadas
+    em paralelo por todos os workers; a última etapa conclui a indexação da coleção.
     """
     try:
         async def __action__():
@@ -239,65 +370,31 @@ def collection_indexation(self, job_id):
                     logger_info(__name__, f'Coleção {job.owner_id} não encontrada')
                     return
             
-                # Obtém todas as fotos da coleção
-                photos = await Photo.filter(
+                # Obtém os ids de todas as fotos ainda não indexadas da coleção
+                photo_ids = await Photo.filter(
                     owner_id=collection.id,
                     owner_type="collection",
                     is_indexed=False
-                ).all()
-                
-                # Inicializa o FaceAnalysis uma única vez (será reutilizado nas threads)
-                recognition = await Recognition.create()
+                ).order_by('id').values_list('id', flat=True)
 
-                # Configuração do ThreadPool
-                max_workers = min(4, len(photos))  # Limita a 4 threads ou menos se tiver poucas fotos
-                loop = asyncio.get_running_loop()
-                
-                # Processa as fotos em paralelo
-                with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                    tasks = []
-                    for photo in photos:
-                        # Submete cada foto para processamento no thread pool
-                        task = loop.run_in_executor(
-                            executor,
-                            lambda p=photo: asyncio.run_coroutine_threadsafe(
-                                recognition.process_single_photo(p),
-                                loop
-                            ).result()
-                        )
-                        tasks.append(task)
-                    
-                    # Aguarda a conclusão de todas as tarefas
-                    await asyncio.gather(*tasks)
-
-                # Query para contar as faces de fotos
-                face_counter_query = f"""
-                    SELECT COUNT(faces.id) FROM faces
-                    INNER JOIN photos ON photos.id=faces.photo_id
-                    WHERE
-                        photos.owner_id={collection.id} AND
-                        photos.owner_type='collection' AND
-                        photos.is_indexed=true
-                """
-                
-                # Executar contagem total
-                face_counter = await execute_raw_sql(face_counter_query)
-                face_counter = face_counter[0]["count"] if face_counter else 0
-                collection.status = CollectionStatus.FINISHED
-                await collection.save()
-                await job.delete()
+                if not photo_ids:
+                    await finish_collection_indexation(collection)
+                    await job.delete()
+                    return
 
-                await sse_manager.publish(
-                    collection.user_id,
-                    {
-                        'entity':'collections', 
-                        'id': collection.id,
-                        'message': f'Coleção {collection.name} indexada com sucesso: {face_counter} faces encontradas'
-                    },
-                    'collection_indexation'
+                # Continua o progresso de uma execução anterior (ex.: extração em fluxo ou nova tentativa)
+                progress = collection_progress(collection)
+                state = await progress.state()
+                await progress.start(int(state.get('done', 0)) + len(photo_ids), job.id, reset=False)
+
+                chunks = [(chunk[0], chunk[-1]) for chunk in chunk_array(photo_ids, IndexationPool.chunk_size)]
+                chord(
+                    group(collection_indexation_chunk.s(collection.id, first_id, last_id) for first_id, last_id in chunks)
+                )(
+                    collection_indexation_finish.s(job.id).on_error(collection_indexation_failed.s(job.id))
                 )
 
-                logger_info(__name__, f'Imagens da coleção {collection.id} indexadas com sucesso')
+                logger_info(__name__, f'Indexação da coleção {collection.id} dividida em {len(chunks)} parte(s)')
             except Exception as e:
                 logger_error(__name__,e)
                 raise
@@ -307,6 +404,68 @@ def collection_indexation(self, job_id):
         logger_error(__name__,e)
         raise
 
+@celery_app.task(bind=True, max_retries=3)
+def collection_indexation_chunk(self, collection_id, first_id, last_id):
+    """
+    Indexa as fotos de uma coleção com id no intervalo informado.
+    Pode ser reexecutada com segurança: fotos já indexadas são ignoradas.
+    """
+    try:
+        async def __action__():
+            photos = await Photo.filter(
+                owner_id=collection_id,
+                owner_type="collection",
+                is_indexed=False,
+                id__gte=first_id,
+                id__lte=last_id
+            ).all()
+
+            # Processa as fotos em paralelo no pool de processos (cada processo com seu modelo)
+            if not photos:
+                return 0
+
+            collection = await Collection.get(id=collection_id)
+            return await IndexationPool.shared().index_photos(photos, collection_progress(collection))
+
+        return async_to_sync(__action__)
+    except Exception as e:
+        logger_error(__name__, e)
+        raise self.retry(exc=e, countdown=30)
+
+@celery_app.task(bind=True, max_retries=0)
+def collection_indexation_finish(self, face_counters, job_id):
+    """
+    Etapa final da indexação em partes: conclui a indexação da coleção
+    """
+    try:
+        async def __action__():
+            job = await check_job(job_id)
+            collection = await Collection.get_or_none(id=job.owner_id)
+            if collection:
+                await finish_collection_indexation(collection)
+                logger_info(__name__, f'Imagens da coleção {collection.id} indexadas com sucesso: {sum(face_counters)} face(s) nesta execução')
+            await job.delete()
+
+        async_to_sync(__action__)
+    except Exception as e:
+        logger_error(__name__, e)
+        raise
+
+@celery_app.task
+def collection_indexation_failed(request, exc, traceback, job_id):
+    """
+    Marca o job de indexação como falho quando uma das partes falha definitivamente,
+    para que ele seja reexecutado (apenas as fotos ainda não indexadas)
+    """
+    async def __action__():
+        job = await Job.get_or_none(id=job_id)
+        if job:
+            job.status = JobStatus.FAILED
+            await job.save()
+
+    logger_error(__name__, exc)
+    async_to_sync(__action__)
+
 @celery_app.task(bind=True, max_retries=0)
 def search_faces(self, job_id):
     """
@@ -329,48 +488,30 @@ def search_faces(self, job_id):
                 search.status = SearchStatus.PROCESSING
                 await search.save()
 
-                # Busca todas as fotos e faces de uma vez
-                photos = await Photo.filter(
-                    owner_id__in=search.collections,
-                    owner_type="collection",
-                    is_indexed=True
-                ).prefetch_related('faces')
-
-                faces_to_search = [face for photo in photos for face in photo.faces]
-                    
-                # Inicializa o reconhecimento
-                recognition = await Recognition.create()
-                
-                try:
-                    # Processa as faces em paralelo (manualmente)
-                    chunk_size = 50  # Processa em lotes para evitar sobrecarga
+                progress = ProgressReporter('searches', search.id, search.user_id, f'Pesquisando faces {search.name}', 'collections')
+                await progress.start(len(search.collections), job.id)
 
-                    for chunk in chunk_array(faces_to_search, chunk_size):
-                        tasks = [recognition.compare_faces(search, face) for face in chunk]
-                        await asyncio.gather(*tasks)
+                # Compara todas as faces das coleções selecionadas de uma só vez
+                await SearchEngine(search).run(progress)
+                await progress.finish()
 
-                    face_counter = await SearchFace.filter(search_id=search.id).count()
-                    # Atualiza status para FINISHED
-                    search.status = SearchStatus.FINISHED
-                    await search.save()
-                    
-                    # Notifica via SSE
-                    await sse_manager.publish(
-                        str(search.user_id),
-                        {
-                            'entity': 'searches', 
-                            'id': search.id, 
-                            'message': f'Pesquisa de faces {search.name} concluída: {face_counter} face(s) encontrada(s)'
-                        },
-                        'search_faces'
-                    )
-                    
-                    logger_info(__name__, f'Pesquisa {search.id} concluída com sucesso')
+                face_counter = await SearchFace.filter(search_id=search.id).count()
+                # Atualiza status para FINISHED
+                search.status = SearchStatus.FINISHED
+                await search.save()
+                
+                # Notifica via SSE
+                await sse_manager.publish(
+                    str(search.user_id),
+                    {
+                        'entity': 'searches', 
+                        'id': search.id, 
+                        'message': f'Pesquisa de faces {search.name} concluída: {face_counter} face(s) encontrada(s)'
+                    },
+                    'search_faces'
+                )
                 
-                finally:
-                    # Garante que o recurso de reconhecimento seja liberado
-                    if hasattr(recognition, 'close'):
-                        await recognition.close()
+                logger_info(__name__, f'Pesquisa {search.id} concluída com sucesso')
                 
             except Exception as e:
                 logger_error(__name__, e)
@@ -389,3 +530,23 @@ def search_faces(self, job_id):
     except Exception as e:
         logger_error(__name__, e)
         raise
+
+@celery_app.task(bind=True, max_retries=0)
+def collection_index_report(self, collection_id, tolerance_level=60, queries=100):
+    """
+    Compara a busca aproximada com a busca exata no índice de uma coleção (recall e latência)
+    """
+    try:
+        async def __action__():
+            index = await update_collection_index(collection_id)
+            if not index:
+                raise Exception(f'Coleção {collection_id} não possui faces indexadas')
+
+            report = index.report(float(tolerance_level * 0.01), queries)
+            logger_info(__name__, f'Relatório do índice da coleção {collection_id}: {report}')
+            return report
+
+        return async_to_sync(__action__)
+    except Exception as e:
+        logger_error(__name__, e)
+        raise
@@ -9,7 +9,9 @@ import os
 import logging
 from logging.handlers import RotatingFileHandler
 import sys,traceback
+import shutil
 import json
+import hashlib
 
 security = HTTPBearer()
 
@@ -62,6 +64,39 @@ def chunk_array(arr, chunk_size):
     for i in range(0, len(arr), chunk_size):
         yield arr[i:i + chunk_size]
 
+def copy_with_hash(source, target, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Copia o conteúdo de um arquivo para outro calculando o SHA-256 durante a cópia
+
+    Returns:
+        str: Hash SHA-256 (hexadecimal) do conteúdo copiado
+    """
+    digest = hashlib.sha256()
+    while chunk := source.read(chunk_size):
+        digest.update(chunk)
+        target.write(chunk)
+    return digest.hexdigest()
+
+def extract_zip_member(zip_ref, member, file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Extrai um único membro do arquivo compactado direto para o caminho final.
+    O arquivo é gravado com sufixo temporário e renomeado ao final para não deixar arquivos parciais.
+
+    Returns:
+        str: Hash SHA-256 do conteúdo extraído
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    temp_path = f"{file_path}.part"
+    try:
+        with zip_ref.open(member) as source, open(temp_path, "wb") as target:
+            content_hash = copy_with_hash(source, target, chunk_size)
+        os.replace(temp_path, file_path)
+        return content_hash
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
 def logger_info(name, message):
     _logger = logging.getLogger(name)
     getattr(_logger, "info")(message)
@@ -150,3 +185,18 @@ async def execute_raw_sql(raw_sql: str,has_result: bool = True):
     except Exception as e:
         logger_error(__name__,e)
         raise 
+
+async def reserve_ids(table: str, quantity: int) -> list:
+    """
+    Reserva ids da sequência de uma tabela para inserções em lote com id conhecido.
+    Args:
+        table (str): Nome da tabela
+        quantity (int): Quantidade de ids
+
+    Returns:
+        list: Ids reservados
+    """
+    rows = await execute_raw_sql(
+        f"SELECT nextval(pg_get_serial_sequence('{table}', 'id')) AS id FROM generate_series(1, {int(quantity)})"
+    )
+    return [row["id"] for row in rows]
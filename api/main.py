@@ -7,8 +7,11 @@ from app.controllers.collection_controller import CollectionController
 from app.controllers.search_controller import SearchController
 from app.controllers.photo_controller import PhotoController
 from app.controllers.sse_controller import SSEController
+from app.controllers.metrics_controller import MetricsController
 from app.utils import setup_logging
-from app.tasks import check_downloaded_model
+from app.tasks import check_downloaded_model, migrate_face_embeddings
+from app.migrations import run_migrations
+from app.services.recognition import Recognition
 import asyncio
 from app.tasks import retry_failed_tasks
 
@@ -25,8 +28,14 @@ async def task_checker():
 async def lifespan(app: FastAPI):
     setup_logging()
     await init_db()  # Inicializa o banco de dados
+    await run_migrations()  # Aplica as alterações de esquema pendentes
     asyncio.create_task(task_checker()) # Cria uma tarefa assíncrona para verificar tarefas com status FAILED
     check_downloaded_model.delay()
+    migrate_face_embeddings.delay()
+
+    # Carrega o modelo em segundo plano para que a primeira pesquisa não espere o carregamento
+    if Recognition.preload:
+        asyncio.get_running_loop().run_in_executor(None, Recognition.get_instance)
     yield
     await close_db()  # Fecha as conexões com o banco de dados
 
@@ -52,4 +61,5 @@ app.include_router(CollectionController().router)
 app.include_router(PhotoController().router)
 app.include_router(SearchController().router)
 app.include_router(SSEController().router)
+app.include_router(MetricsController().router)
 
@@ -0,0 +1,26 @@
+import asyncio
+import os
+
+# Os testes usam um banco SQLite em memória no lugar do PostgreSQL; o Redis não é acessado
+os.environ.setdefault("DATABASE_POSTGRES_URL", "sqlite://:memory:")
+os.environ.setdefault("DATABASE_REDIS_URL", "redis://localhost:6379/0")
+
+import pytest
+from tortoise import Tortoise
+from app.config import TORTOISE_ORM
+
+@pytest.fixture
+def run_db():
+    """
+    Executa uma corrotina com o Tortoise inicializado em um banco SQLite em memória
+    """
+    def run(test):
+        async def wrapper():
+            await Tortoise.init(config={**TORTOISE_ORM, "connections": {"default": "sqlite://:memory:"}})
+            await Tortoise.generate_schemas()
+            try:
+                return await test()
+            finally:
+                await Tortoise.close_connections()
+        return asyncio.run(wrapper())
+    return run
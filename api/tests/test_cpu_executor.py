@@ -0,0 +1,59 @@
+import asyncio
+import threading
+import pytest
+from app.services.cpu_executor import CpuExecutor, CpuExecutorSaturated
+
+def test_run_returns_result_and_counts():
+    executor = CpuExecutor(workers=2, max_queue=1)
+
+    async def run():
+        return await asyncio.gather(*(executor.run('square', pow, value, 2) for value in range(3)))
+
+    assert asyncio.run(run()) == [0, 1, 4]
+    metrics = executor.metrics()
+    assert metrics['pending'] == 0
+    assert metrics['operations']['square']['count'] == 3
+    assert metrics['operations']['square']['rejected'] == 0
+    assert metrics['operations']['square']['run_ms']['avg'] is not None
+
+def test_saturated_rejects_with_retry_after():
+    executor = CpuExecutor(workers=1, max_queue=1)
+    release = threading.Event()
+
+    async def run():
+        # Um trabalho em execução e outro na fila ocupam o executor
+        busy = [asyncio.ensure_future(executor.run('decode', release.wait)) for _ in range(2)]
+        await asyncio.sleep(0)
+        try:
+            with pytest.raises(CpuExecutorSaturated) as error:
+                await executor.run('decode', release.wait)
+        finally:
+            release.set()
+        await asyncio.gather(*busy)
+        return error.value
+
+    error = asyncio.run(run())
+    assert error.status_code == 503
+    assert error.headers['Retry-After'] == str(CpuExecutor.retry_after)
+
+    stats = executor.metrics()['operations']['decode']
+    assert stats['count'] == 2
+    assert stats['rejected'] == 1
+    # Com a fila livre, novos trabalhos voltam a ser aceitos
+    assert asyncio.run(executor.run('decode', release.wait)) is True
+
+def test_errors_are_counted():
+    executor = CpuExecutor(workers=1, max_queue=0)
+
+    with pytest.raises(ZeroDivisionError):
+        asyncio.run(executor.run('divide', lambda: 1 / 0))
+
+    stats = executor.metrics()['operations']['divide']
+    assert stats['count'] == 1
+    assert stats['errors'] == 1
+    assert executor.pending == 0
+
+def test_percentiles():
+    assert CpuExecutor.percentiles([]) == {'avg': None, 'p50': None, 'p99': None, 'max': None}
+    samples = [value / 1000 for value in range(1, 101)]  # 1 a 100 ms
+    assert CpuExecutor.percentiles(reversed(samples)) == {'avg': 50.5, 'p50': 51.0, 'p99': 100.0, 'max': 100.0}
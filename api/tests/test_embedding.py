@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from app.services.embedding import EMBEDDING_DTYPE, EMBEDDING_SIZE, normalize, encode_embedding, decode_embedding, decode_embeddings
+
+def test_normalize_returns_unit_vectors():
+    vectors = normalize([[3, 4], [0, 0]])
+    assert vectors.dtype == np.float32
+    np.testing.assert_allclose(vectors[0], [0.6, 0.8], rtol=1e-6)
+    # Vetores nulos não geram divisão por zero
+    np.testing.assert_array_equal(vectors[1], [0, 0])
+
+def test_encode_decode_round_trip():
+    vector = np.random.default_rng(0).normal(size=EMBEDDING_SIZE)
+    buffer = encode_embedding(vector)
+    assert len(buffer) == EMBEDDING_SIZE * EMBEDDING_DTYPE.itemsize
+
+    decoded = decode_embedding(buffer)
+    np.testing.assert_allclose(decoded, normalize(vector), atol=1e-3)
+    assert abs(np.linalg.norm(decoded.astype(np.float32)) - 1) < 1e-3
+
+def test_decode_embeddings_stacks_matrix():
+    vectors = np.random.default_rng(1).normal(size=(3, EMBEDDING_SIZE))
+    matrix = decode_embeddings(encode_embedding(vector) for vector in vectors)
+    assert matrix.shape == (3, EMBEDDING_SIZE)
+    assert matrix.dtype == np.float32
+    np.testing.assert_allclose(matrix, normalize(vectors), atol=1e-3)
+
+def test_decode_embeddings_empty():
+    assert decode_embeddings([]).shape == (0, EMBEDDING_SIZE)
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float16])
+def test_decode_identifies_dtype_by_length(dtype):
+    vector = normalize(np.random.default_rng(2).normal(size=EMBEDDING_SIZE))
+    decoded = decode_embedding(vector.astype(dtype).tobytes())
+    assert decoded.dtype == dtype
+    assert decoded.shape == (EMBEDDING_SIZE,)
+    np.testing.assert_allclose(decoded, vector, atol=1e-3)
+
+def test_decode_embeddings_mixed_dtypes():
+    vectors = normalize(np.random.default_rng(3).normal(size=(2, EMBEDDING_SIZE)))
+    matrix = decode_embeddings([vectors[0].astype(np.float32).tobytes(), vectors[1].astype(np.float16).tobytes()])
+    assert matrix.shape == (2, EMBEDDING_SIZE)
+    np.testing.assert_allclose(matrix, vectors, atol=1e-3)
+
+@pytest.mark.parametrize("size", [0, 100, EMBEDDING_SIZE * 3])
+def test_decode_rejects_invalid_length(size):
+    with pytest.raises(ValueError):
+        decode_embedding(b"\0" * size)
+    with pytest.raises(ValueError):
+        decode_embeddings([b"\0" * size])
@@ -0,0 +1,180 @@
+import asyncio
+import numpy as np
+import pytest
+from app.services.embedding import normalize
+from app.services.face_index import FaceIndex, update_collection_index
+from app.services.face_reader import FaceReader
+
+def clustered(count: int, clusters: int = 40, dimension: int = 64, seed: int = 0) -> np.ndarray:
+    """
+    Embeddings agrupados em torno de centros aleatórios, como faces de poucas pessoas
+    """
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.normal(size=(clusters, dimension)))
+    vectors = centers[rng.integers(0, clusters, count)] + rng.normal(scale=0.08, size=(count, dimension))
+    return normalize(vectors)
+
+def brute_force(vectors: np.ndarray, face_ids: np.ndarray, reference: np.ndarray, threshold: float) -> set:
+    return set(face_ids[vectors @ reference >= threshold].tolist())
+
+@pytest.fixture(autouse=True)
+def index_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(FaceIndex, "root", str(tmp_path))
+    monkeypatch.setattr(FaceIndex, "_cache", type(FaceIndex._cache)())
+    return tmp_path
+
+def build(count: int, first_id: int = 1, seed: int = 0):
+    vectors = clustered(count, seed=seed)
+    face_ids = np.arange(first_id, first_id + count, dtype=np.int64)
+    return FaceIndex.build(face_ids, face_ids // 3, vectors), vectors, face_ids
+
+def test_small_index_is_exact():
+    index, vectors, face_ids = build(200)
+    assert len(index.centroids) == 1
+
+    reference = vectors[0]
+    found, _, _ = index.search(reference, 0.5)
+    assert set(found.tolist()) == brute_force(vectors, face_ids, reference, 0.5)
+
+def test_recall_against_brute_force():
+    index, vectors, face_ids = build(5000)
+    assert len(index.centroids) > index.nprobe
+
+    recalls = []
+    for position in range(0, 5000, 250):
+        reference = vectors[position]
+        expected = brute_force(vectors, face_ids, reference, 0.6)
+        found, photo_ids, similarities = index.search(reference, 0.6)
+
+        assert set(found.tolist()) <= expected
+        assert (similarities >= 0.6).all()
+        np.testing.assert_array_equal(photo_ids, found // 3)
+        recalls.append(len(expected & set(found.tolist())) / len(expected))
+
+    assert np.mean(recalls) >= 0.95
+    assert index.report(0.6, queries=20)['recall'] >= 0.95
+
+def test_search_exact_matches_brute_force():
+    index, vectors, face_ids = build(3000)
+    reference = vectors[10]
+    found, _, similarities = index.search_exact(reference, 0.6)
+    assert set(found.tolist()) == brute_force(vectors, face_ids, reference, 0.6)
+    np.testing.assert_allclose(np.sort(similarities), np.sort(vectors @ reference)[-len(similarities):], rtol=1e-5)
+
+def test_extend_after_build():
+    index, _, _ = build(3000)
+    new_vectors = clustered(500, seed=1)
+    new_ids = np.arange(10001, 10501, dtype=np.int64)
+
+    extended = index.extend(new_ids, new_ids // 3, new_vectors)
+
+    assert extended.size == 3500
+    assert extended.trained_size == index.trained_size
+    np.testing.assert_array_equal(extended.centroids, index.centroids)
+    assert extended.max_face_id == 10500
+    assert set(extended.face_ids.tolist()) == set(range(1, 3001)) | set(new_ids.tolist())
+    # Cada nova face é encontrada por ela mesma
+    for position in range(0, 500, 50):
+        found, _, _ = extended.search(new_vectors[position], 0.99)
+        assert new_ids[position] in found
+
+def test_extend_retrains_when_size_doubles():
+    index, _, _ = build(1000)
+    new_ids = np.arange(5001, 6101, dtype=np.int64)
+
+    extended = index.extend(new_ids, new_ids, clustered(1100, seed=2))
+
+    assert extended.trained_size == 2100
+    assert extended.size == 2100
+
+def test_extend_small_index_builds_lists():
+    index, _, _ = build(500)
+    new_ids = np.arange(1001, 1601, dtype=np.int64)
+
+    extended = index.extend(new_ids, new_ids, clustered(600, seed=3))
+
+    assert len(index.centroids) == 1
+    assert len(extended.centroids) > 1
+
+def test_save_load_round_trip():
+    index, vectors, _ = build(3000)
+    index.save(7)
+
+    loaded = FaceIndex.load(7)
+
+    assert isinstance(loaded.vectors, np.memmap)
+    assert loaded.trained_size == index.trained_size
+    for name in FaceIndex.files:
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(index, name))
+
+    expected = index.search(vectors[5], 0.6)
+    for expected_values, loaded_values in zip(expected, loaded.search(vectors[5], 0.6)):
+        np.testing.assert_array_equal(expected_values, loaded_values)
+
+def test_load_missing_index():
+    assert FaceIndex.load(99) is None
+
+def test_no_stale_face_ids_after_invalidation():
+    index, vectors, face_ids = build(3000)
+    index.save(7)
+    assert FaceIndex.load(7) is not None
+
+    # Fotos removidas invalidam o índice, mesmo o já mapeado pelo processo
+    FaceIndex.invalidate(7)
+    assert FaceIndex.load(7) is None
+
+    # O índice recriado com as faces restantes não retorna as faces removidas
+    remaining = face_ids % 2 == 0
+    FaceIndex.build(face_ids[remaining], face_ids[remaining], vectors[remaining]).save(7)
+    found, _, _ = FaceIndex.load(7).search(vectors[1], 0.0)
+    assert len(found)
+    assert not set(found.tolist()) & set(face_ids[~remaining].tolist())
+
+def test_loaded_indexes_limited_by_memory(monkeypatch):
+    for collection_id in (1, 2, 3):
+        build(200, seed=collection_id)[0].save(collection_id)
+
+    # Cabem dois índices mapeados por processo
+    monkeypatch.setattr(FaceIndex, "cache_size", 2 * FaceIndex.load(1).nbytes + 1)
+    first = FaceIndex.load(1)
+    FaceIndex.load(2)
+    # O acesso move a coleção 1 para o fim: a coleção 2 passa a ser a usada há mais tempo
+    assert FaceIndex.load(1) is first
+    FaceIndex.load(3)
+
+    assert list(FaceIndex._cache) == [1, 3]
+    assert FaceIndex.load(1) is first
+    # A coleção descartada é mapeada novamente a partir dos arquivos
+    assert FaceIndex.load(2) is not None
+    assert list(FaceIndex._cache) == [1, 2]
+
+def test_oversized_index_stays_loaded(monkeypatch):
+    monkeypatch.setattr(FaceIndex, "cache_size", 1)
+    build(200)[0].save(1)
+    assert FaceIndex.load(1) is FaceIndex.load(1)
+    assert list(FaceIndex._cache) == [1]
+
+def test_rebuild_replaces_loaded_index(monkeypatch):
+    index, vectors, face_ids = build(200)
+    index.save(7)
+    cached = FaceIndex.load(7)
+    assert FaceIndex.load(7) is cached
+
+    new_vectors = clustered(100, seed=1)
+    new_ids = np.arange(201, 301, dtype=np.int64)
+    readers = []
+
+    async def read_all(self):
+        readers.append(self.min_face_id)
+        return new_ids, new_ids // 3, new_vectors
+
+    monkeypatch.setattr(FaceReader, "read_all", read_all)
+    asyncio.run(update_collection_index(7))
+
+    # Apenas as faces ainda não indexadas são lidas e o índice regravado substitui o mapeado
+    assert readers == [200]
+    loaded = FaceIndex.load(7)
+    assert loaded is not cached
+    assert loaded.size == 300
+    found, _, _ = loaded.search(new_vectors[0], 0.99)
+    assert 201 in found.tolist()
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import pytest
+from app import utils
+from app.models.face import Face
+from app.models.photo import Photo
+from app.models.user import User
+from app.services import face_writer
+from app.services.face_index import FaceIndex
+from app.services.face_writer import FaceWriter
+
+def result(count: int) -> list:
+    return [{"data": {"score": 0.9}, "embedding": b"\0" * 2048, "crop": b"crop"} for _ in range(count)]
+
+async def create_photo(tmp_path, name: str = "a.jpg") -> Photo:
+    user = await User.get_or_none(username="user") or await User.create(username="user", email="user", password_hash="x")
+    return await Photo.create(
+        user_id=user.id, original_name=name, file_path=str(tmp_path / name), extension_type=".jpg",
+        mime_type="image/jpeg", size=1, owner_type="collection", owner_id=7
+    )
+
+@pytest.fixture
+def ids(monkeypatch):
+    """
+    Sequência de ids no lugar do nextval do PostgreSQL
+    """
+    counter = iter(range(1000, 2000))
+
+    async def reserve_ids(table, quantity):
+        return [next(counter) for _ in range(quantity)]
+
+    monkeypatch.setattr(face_writer, "reserve_ids", reserve_ids)
+
+@pytest.fixture
+def sqlite_status(monkeypatch):
+    """
+    Atualização de status equivalente no SQLite (o unnest é exclusivo do PostgreSQL)
+    """
+    def status_query(batch, model_version=None):
+        ids = ", ".join(str(photo.id) for photo, _ in batch)
+        return f"UPDATE photos SET is_indexed = 1, model_version = ? WHERE id IN ({ids})", [model_version]
+
+    monkeypatch.setattr(FaceWriter, "status_query", staticmethod(status_query))
+
+def test_status_query():
+    batch = [(Photo(id=1), result(2)), (Photo(id=5), [])]
+    sql, values = FaceWriter.status_query(batch, "buffalo_l/full/1280")
+    assert "unnest($2::int[], $3::int[])" in sql
+    assert values == ["buffalo_l/full/1280", [1, 5], [2, 0]]
+
+def test_reserve_ids(monkeypatch):
+    queries = []
+
+    async def execute_raw_sql(query):
+        queries.append(query)
+        return [{"id": 10}, {"id": 11}]
+
+    monkeypatch.setattr(utils, "execute_raw_sql", execute_raw_sql)
+    assert asyncio.run(utils.reserve_ids("faces", 2)) == [10, 11]
+    assert "pg_get_serial_sequence('faces', 'id')" in queries[0]
+    assert "generate_series(1, 2)" in queries[0]
+
+def test_write_saves_faces_and_crops(run_db, tmp_path, ids, sqlite_status):
+    async def test():
+        photo = await create_photo(tmp_path)
+        await FaceWriter.write([(photo, result(2))], "v1")
+
+        faces = await Face.filter(photo_id=photo.id).order_by("id").values_list("id", flat=True)
+        assert faces == [1000, 1001]
+        for face_id in faces:
+            with open(Face.build_face_path(photo, face_id), "rb") as f:
+                assert f.read() == b"crop"
+
+        saved = await Photo.get(id=photo.id)
+        assert saved.is_indexed and saved.model_version == "v1"
+        assert photo.face_count == 2
+
+    run_db(test)
+
+def test_write_replaces_previous_faces(run_db, tmp_path, ids, sqlite_status, monkeypatch):
+    invalidated = []
+    monkeypatch.setattr(FaceIndex, "invalidate", classmethod(lambda cls, collection_id: invalidated.append(collection_id)))
+
+    async def test():
+        photo = await create_photo(tmp_path)
+        await FaceWriter.write([(photo, result(2))], "v1")
+        old_paths = [Face.build_face_path(photo, face_id) for face_id in (1000, 1001)]
+
+        await FaceWriter.write([(photo, result(1))], "v1")
+
+        assert await Face.filter(photo_id=photo.id).values_list("id", flat=True) == [1002]
+        assert not any(os.path.exists(path) for path in old_paths)
+        assert invalidated == [7]
+
+    run_db(test)
+
+def test_write_failure_removes_crops(run_db, tmp_path, ids):
+    async def test():
+        photo = await create_photo(tmp_path)
+        # O unnest do PostgreSQL falha no SQLite: a transação é desfeita
+        with pytest.raises(Exception):
+            await FaceWriter.write([(photo, result(2))], "v1")
+
+        assert await Face.filter(photo_id=photo.id).count() == 0
+        assert not os.listdir(tmp_path / "faces")
+        assert not (await Photo.get(id=photo.id)).is_indexed
+
+    run_db(test)
+
+def test_flush_isolates_failing_photo(run_db, tmp_path, ids, sqlite_status, monkeypatch):
+    write = FaceWriter.write.__func__
+
+    async def failing_write(cls, batch, model_version=None):
+        if any(photo.original_name == "bad.jpg" for photo, _ in batch):
+            raise ValueError("falha")
+        return await write(cls, batch, model_version)
+
+    monkeypatch.setattr(FaceWriter, "write", classmethod(failing_write))
+
+    async def test():
+        good = await create_photo(tmp_path, "good.jpg")
+        bad = await create_photo(tmp_path, "bad.jpg")
+        writer = FaceWriter(batch_size=10, flush_interval=60, model_version="v1")
+        await writer.add(good, result(1))
+        await writer.add(bad, result(1))
+
+        assert await writer.flush() == 1
+        assert (await Photo.get(id=good.id)).is_indexed
+        assert not (await Photo.get(id=bad.id)).is_indexed
+        assert writer.pending == []
+
+    run_db(test)
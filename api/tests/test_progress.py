@@ -0,0 +1,126 @@
+import time
+import pytest
+from app.models.job import Job
+from app.services.progress import ProgressReporter
+from app.services.sse_manager import sse_manager
+
+class FakeRedis:
+    """
+    Subconjunto dos comandos do Redis usados pelo progresso, com expiração do SET PX
+    """
+    def __init__(self):
+        self.hashes = {}
+        self.values = {}
+
+    async def hgetall(self, key):
+        return {field: str(value) for field, value in self.hashes.get(key, {}).items()}
+
+    async def hset(self, key, mapping):
+        self.hashes.setdefault(key, {}).update(mapping)
+
+    async def hsetnx(self, key, field, value):
+        self.hashes.setdefault(key, {}).setdefault(field, value)
+
+    async def hincrby(self, key, field, amount):
+        values = self.hashes.setdefault(key, {})
+        values[field] = int(values.get(field, 0)) + amount
+
+    async def expire(self, key, seconds):
+        pass
+
+    async def set(self, key, value, nx=False, px=None):
+        expires_at = self.values.get(key)
+        if nx and expires_at and expires_at > time.monotonic():
+            return None
+        self.values[key] = time.monotonic() + px / 1000
+        return True
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.hashes.pop(key, None)
+            self.values.pop(key, None)
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(ProgressReporter, "redis", property(lambda self: redis))
+    return redis
+
+@pytest.fixture
+def events(monkeypatch):
+    events = []
+
+    async def publish(user_id, data, event_type=None):
+        events.append(data)
+
+    monkeypatch.setattr(sse_manager, "publish", publish)
+    return events
+
+def reporter(interval: float = 60) -> ProgressReporter:
+    progress = ProgressReporter('collections', 1, 1, 'Indexando')
+    progress.interval = interval
+    return progress
+
+def test_update_is_accumulated_locally(run_db, redis, events):
+    async def test():
+        progress = reporter()
+        await progress.start(10)
+        await progress.update(done=3, faces=5)
+
+        assert (await progress.state()).get('done') is None
+        assert progress.pending_done == 3 and progress.pending_faces == 5
+        assert events == []
+
+    run_db(test)
+
+def test_one_event_per_interval_across_workers(run_db, redis, events):
+    async def test():
+        job = await Job.create(process_type='collection_indexation', owner_type='collection', owner_id=1)
+        first, second = reporter(), reporter()
+        await first.start(10, job.id)
+
+        first.pending_done = 2
+        await first.flush()
+        second.pending_done = 3
+        await second.flush()
+
+        # O segundo worker soma seus contadores, mas não publica dentro do intervalo
+        assert [event['done'] for event in events] == [2]
+        assert (await first.state())['done'] == '5'
+        assert (await Job.get(id=job.id)).progress['done'] == 2
+
+    run_db(test)
+
+def test_events_resume_after_interval(run_db, redis, events):
+    async def test():
+        progress = reporter(interval=0.01)
+        await progress.start(10)
+        progress.pending_done = 1
+        await progress.flush()
+        time.sleep(0.02)
+        progress.pending_done = 1
+        await progress.flush()
+
+        assert [event['done'] for event in events] == [1, 2]
+
+    run_db(test)
+
+def test_finish_publishes_final_progress_inside_interval(run_db, redis, events):
+    async def test():
+        job = await Job.create(process_type='collection_indexation', owner_type='collection', owner_id=1)
+        progress = reporter()
+        await progress.start(10, job.id)
+        progress.pending_done = 4
+        await progress.flush()
+
+        progress.pending_done = 5
+        progress.pending_faces = 7
+        await progress.finish()
+
+        assert len(events) == 2
+        assert events[-1]['done'] == events[-1]['total'] == 10
+        assert events[-1]['faces'] == 7
+        assert (await Job.get(id=job.id)).progress['done'] == 10
+        assert redis.hashes == {} and redis.values == {}
+
+    run_db(test)
@@ -0,0 +1,60 @@
+from io import BytesIO
+import numpy as np
+import pytest
+from PIL import Image
+from insightface.app.common import Face
+from app.services.recognition import Recognition
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA", "L", "LA", "P", "1", "I;16", "I", "CMYK"])
+def test_decode_image_reduces_every_mode(tmp_path, mode):
+    file_path = tmp_path / "photo.tiff"
+    Image.new(mode, (3000, 2000)).save(file_path)
+
+    img, scale, image_format = Recognition.decode_image(str(file_path), max_size=1000)
+
+    assert img.mode == "RGB"
+    assert max(img.size) < 3000
+    assert scale == (3000 / img.width, 2000 / img.height)
+    assert image_format == "TIFF"
+
+def test_decode_image_uses_jpeg_draft(tmp_path):
+    file_path = tmp_path / "photo.jpg"
+    Image.new("RGB", (4000, 3000)).save(file_path)
+
+    img, scale, image_format = Recognition.decode_image(str(file_path), max_size=1000)
+
+    assert image_format == "JPEG"
+    assert img.size == (1000, 750)
+    assert scale == (4.0, 4.0)
+
+def test_decode_image_keeps_small_images(tmp_path):
+    file_path = tmp_path / "photo.png"
+    Image.new("P", (640, 480)).save(file_path)
+
+    img, scale, _ = Recognition.decode_image(str(file_path), max_size=1000)
+
+    assert img.mode == "RGB"
+    assert img.size == (640, 480)
+    assert scale == (1.0, 1.0)
+
+def test_decode_image_applies_exif_orientation(tmp_path):
+    file_path = tmp_path / "photo.jpg"
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Rotação de 90°
+    Image.new("RGB", (4000, 3000)).save(file_path, exif=exif)
+
+    img, scale, _ = Recognition.decode_image(str(file_path), max_size=1000)
+
+    assert img.size == (750, 1000)
+    assert scale == (4.0, 4.0)
+
+def test_crop_faces_uses_original_resolution(tmp_path):
+    file_path = tmp_path / "photo.jpg"
+    Image.new("RGB", (4000, 3000)).save(file_path)
+    img, scale, image_format = Recognition.decode_image(str(file_path), max_size=1000)
+    recognition = Recognition.__new__(Recognition)
+    face = Face(bbox=np.array([100, 100, 150, 160], dtype=np.float32))
+
+    crops = recognition.crop_faces(img, scale, image_format, [face], str(file_path))
+
+    assert Image.open(BytesIO(crops[0])).size == (200, 240)
@@ -0,0 +1,97 @@
+import asyncio
+import os
+import threading
+import time
+import pytest
+from PIL import Image
+from app.services.cpu_executor import CpuExecutor
+from app.services.rendition_cache import RenditionCache
+
+@pytest.fixture(autouse=True)
+def cache_root(tmp_path, monkeypatch):
+    root = tmp_path / "cache"
+    monkeypatch.setattr(RenditionCache, "root", str(root))
+    monkeypatch.setattr(RenditionCache, "_size", None)
+    monkeypatch.setattr(RenditionCache, "_pending", {})
+    monkeypatch.setattr(CpuExecutor, "_shared", CpuExecutor(workers=2, max_queue=8))
+    return root
+
+@pytest.fixture
+def photo(tmp_path) -> str:
+    path = str(tmp_path / "photo.jpg")
+    Image.new("RGB", (1600, 1200), (200, 80, 40)).save(path)
+    return path
+
+def write_entry(root, name: str, size: int, used_at: float) -> str:
+    os.makedirs(root, exist_ok=True)
+    path = str(root / name)
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    os.utime(path, (used_at, used_at))
+    return path
+
+def test_get_builds_rendition(photo):
+    path = asyncio.run(RenditionCache.get(1, photo, "thumbnail"))
+
+    assert path == RenditionCache.get_path(1, "thumbnail")
+    with Image.open(path) as img:
+        assert max(img.size) == 300
+
+def test_concurrent_gets_build_once(photo, monkeypatch):
+    build = RenditionCache.build
+    calls = []
+
+    def counted(file_path, name, path):
+        calls.append(threading.get_ident())
+        time.sleep(0.05)
+        return build(file_path, name, path)
+
+    monkeypatch.setattr(RenditionCache, "build", counted)
+
+    async def run():
+        return await asyncio.gather(*(RenditionCache.get(1, photo, "scaled") for _ in range(8)))
+
+    paths = asyncio.run(run())
+    assert len(calls) == 1
+    assert set(paths) == {RenditionCache.get_path(1, "scaled")}
+    assert os.path.exists(paths[0])
+    assert RenditionCache._pending == {}
+
+def test_hit_marks_use(photo):
+    path = asyncio.run(RenditionCache.get(1, photo, "thumbnail"))
+    os.utime(path, (1_000_000, 1_000_000))
+
+    asyncio.run(RenditionCache.get(1, photo, "thumbnail"))
+    assert os.stat(path).st_mtime > time.time() - 60
+
+def test_evict_removes_least_recently_used(cache_root, monkeypatch):
+    now = time.time()
+    oldest = write_entry(cache_root, "1_300.webp", 400, now - 300)
+    older = write_entry(cache_root, "2_300.webp", 400, now - 200)
+    recent = write_entry(cache_root, "3_300.webp", 400, now - 100)
+    kept = write_entry(cache_root, "4_300.webp", 400, now - 400)
+    write_entry(cache_root, "5_300.webp.tmp-1", 400, now - 500)
+
+    monkeypatch.setattr(RenditionCache, "max_size", 1000)
+    RenditionCache.evict(keep=kept)
+
+    # Libera espaço até 90% do limite, sem remover a versão recém-gerada nem os temporários
+    assert not os.path.exists(oldest)
+    assert not os.path.exists(older)
+    assert os.path.exists(recent)
+    assert os.path.exists(kept)
+    assert os.path.exists(f"{cache_root}/5_300.webp.tmp-1")
+    assert RenditionCache._size == 800
+
+def test_version_ignores_cache_file(photo):
+    path = asyncio.run(RenditionCache.get(1, photo, "thumbnail"))
+    version = RenditionCache.get_version(photo, "thumbnail")
+
+    # Usar ou gerar a versão novamente não muda o ETag
+    os.remove(path)
+    asyncio.run(RenditionCache.get(1, photo, "thumbnail"))
+    assert RenditionCache.get_version(photo, "thumbnail") == version
+    assert RenditionCache.get_version(photo, "scaled") != version
+
+    os.utime(photo, ns=(0, os.stat(photo).st_mtime_ns + 1))
+    assert RenditionCache.get_version(photo, "thumbnail") != version
@@ -0,0 +1,133 @@
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from tortoise.backends.base.client import TransactionalDBClient
+from app.models.face import Face
+from app.models.photo import Photo
+from app.models.search import Search, SearchMode
+from app.models.search_face import SearchFace
+from app.models.user import User
+from app.services.search_engine import SearchEngine
+
+def engine(tolerance_level=60, mode=SearchMode.THRESHOLD, top_k=None) -> SearchEngine:
+    return SearchEngine(SimpleNamespace(id=1, user_id=1, tolerance_level=tolerance_level, mode=mode, top_k=top_k))
+
+def test_scan_threshold_keeps_score_floor():
+    assert engine(60).scan_threshold == SearchEngine.score_floor
+    assert engine(5).scan_threshold == 0.05
+    assert engine(60, SearchMode.TOP_K, 10).scan_threshold == SearchEngine.score_floor
+
+def test_top_k_is_limited():
+    assert engine(60).top_k is None
+    assert engine(60, SearchMode.TOP_K, 0).top_k == 1
+    assert engine(60, SearchMode.TOP_K, SearchEngine.max_top_k + 1).top_k == SearchEngine.max_top_k
+
+def test_rank_by_threshold_sorted_desc():
+    similarities = np.array([0.5, 0.9, 0.6, 0.6451, 0.7], dtype=np.float32)
+    selected = engine(65).rank(similarities)
+    # 0.6451 ficaria acima da tolerância se fosse arredondada para 0.65
+    assert selected.tolist() == [1, 4]
+
+def test_rank_top_k():
+    similarities = np.array([0.2, 0.9, 0.4, 0.8, 0.1], dtype=np.float32)
+    assert engine(60, SearchMode.TOP_K, 2).rank(similarities).tolist() == [1, 3]
+    assert engine(60, SearchMode.TOP_K, 10).rank(similarities).tolist() == [1, 3, 2, 0, 4]
+
+def test_rank_empty():
+    assert engine(60).rank(np.empty(0, dtype=np.float32)).tolist() == []
+
+def test_match_filters_by_scan_threshold():
+    face_ids = np.array([10, 11, 12])
+    photo_ids = np.array([1, 1, 2])
+    matrix = np.array([[1, 0], [0, 1], [0.6, 0.8]], dtype=np.float32)
+    reference = np.array([1, 0], dtype=np.float32)
+
+    matched_faces, matched_photos, similarities = engine(60).match(face_ids, photo_ids, matrix, reference)
+
+    assert matched_faces.tolist() == [10, 12]
+    assert matched_photos.tolist() == [1, 2]
+    np.testing.assert_allclose(similarities, [1.0, 0.6])
+
+def test_rank_presorted_slices_prefix():
+    similarities = np.array([0.9, 0.71, 0.6451, 0.6, 0.5], dtype=np.float32)
+    assert engine(65).rank(similarities, presorted=True).tolist() == [0, 1]
+    assert engine(70).rank(similarities, presorted=True).tolist() == [0, 1]
+    assert engine(95).rank(similarities, presorted=True).tolist() == []
+    assert engine(60, SearchMode.TOP_K, 3).rank(similarities, presorted=True).tolist() == [0, 1, 2]
+    assert engine(60, SearchMode.TOP_K, 10).rank(similarities, presorted=True).tolist() == [0, 1, 2, 3, 4]
+
+def test_sort_scores():
+    face_ids, photo_ids, similarities = SearchEngine.sort_scores(
+        np.array([10, 11, 12]), np.array([1, 2, 3]), np.array([0.5, 0.9, 0.7], dtype=np.float32)
+    )
+    assert face_ids.tolist() == [11, 12, 10]
+    assert photo_ids.tolist() == [2, 3, 1]
+
+@pytest.fixture
+def scores_path(monkeypatch, tmp_path):
+    monkeypatch.setattr(SearchEngine, "scores_path", property(lambda self: str(tmp_path / f"{self.search.id}.npz")))
+
+def test_load_scores_sorts_old_files(scores_path, tmp_path):
+    np.savez(
+        tmp_path / "1.npz", face_ids=np.array([10, 11, 12]), photo_ids=np.array([1, 2, 3]),
+        similarities=np.array([0.5, 0.9, 0.7], dtype=np.float32), floor=np.float32(0.1)
+    )
+    face_ids, _, similarities = engine(60).load_scores()
+    assert face_ids.tolist() == [11, 12, 10]
+    assert similarities.tolist() == sorted(similarities.tolist(), reverse=True)
+
+@pytest.fixture
+def matches(monkeypatch):
+    """
+    Registra as faces gravadas (o insert com unnest é exclusivo do PostgreSQL)
+    """
+    saved = []
+
+    async def save_matches(self, face_ids, photo_ids, similarities, conn=None):
+        assert isinstance(conn, TransactionalDBClient)
+        saved.append((face_ids.tolist(), similarities.tolist()))
+        return len(face_ids)
+
+    monkeypatch.setattr(SearchEngine, "save_matches", save_matches)
+    return saved
+
+async def create_search_faces(count: int):
+    user = await User.create(username="user", email="user", password_hash="x")
+    search = await Search.create(user_id=user.id, name="search", tolerance_level=60)
+    photo = await Photo.create(
+        user_id=user.id, original_name="a.jpg", file_path="a.jpg", extension_type=".jpg",
+        mime_type="image/jpeg", size=1, owner_type="collection", owner_id=1
+    )
+    faces = [await Face.create(data={}, user_id=user.id, photo_id=photo.id) for _ in range(count)]
+    for face in faces:
+        await SearchFace.create(search_id=search.id, face_id=face.id, photo_id=photo.id, user_id=user.id)
+    return search, photo, faces
+
+def test_retune_keeps_only_selected_faces(run_db, scores_path, matches):
+    async def test():
+        search, photo, faces = await create_search_faces(4)
+        face_ids = np.array([face.id for face in faces])
+        similarities = np.array([0.55, 0.92, 0.71, 0.64], dtype=np.float32)
+        search_engine = SearchEngine(search)
+        search_engine.save_scores(*SearchEngine.sort_scores(face_ids, np.full(4, photo.id), similarities))
+
+        search.tolerance_level = 70
+        created = await SearchEngine(search).retune()
+        remaining = await SearchFace.filter(search_id=search.id).values_list("face_id", flat=True)
+        return face_ids, created, sorted(remaining)
+
+    face_ids, created, remaining = run_db(test)
+    assert created == 2
+    assert matches == [([face_ids[1], face_ids[2]], pytest.approx([0.92, 0.71]))]
+    assert remaining == [face_ids[1], face_ids[2]]
+
+def test_retune_needs_new_search_below_floor(run_db, scores_path, matches):
+    async def test():
+        search, photo, faces = await create_search_faces(1)
+        SearchEngine(search).save_scores(np.array([faces[0].id]), np.array([photo.id]), np.array([0.9], dtype=np.float32))
+
+        search.tolerance_level = 5
+        return await SearchEngine(search).retune()
+
+    assert run_db(test) is None
+    assert matches == []
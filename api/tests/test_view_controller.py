@@ -0,0 +1,60 @@
+import pytest
+from email.utils import formatdate
+from fastapi import HTTPException
+from starlette.requests import Request
+from app.controllers.view_controller import ViewController
+
+ETAG = '"400-1"'
+MTIME = 1_700_000_000
+
+def request(**headers) -> Request:
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+    })
+
+@pytest.mark.parametrize("header,expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 1023)),
+    ("bytes=-100", (924, 1023)),
+    ("bytes=1000-5000", (1000, 1023)),
+    ("bytes=-5000", (0, 1023)),
+])
+def test_parse_range(header, expected):
+    assert ViewController.parse_range(request(range=header), ETAG, 1024) == expected
+
+@pytest.mark.parametrize("header", [None, "items=0-10", "bytes=0-1,5-9", "bytes=a-b"])
+def test_parse_range_sends_whole_file(header):
+    headers = {"range": header} if header else {}
+    assert ViewController.parse_range(request(**headers), ETAG, 1024) is None
+
+@pytest.mark.parametrize("header", ["bytes=1024-", "bytes=50-10"])
+def test_parse_range_not_satisfiable(header):
+    with pytest.raises(HTTPException) as error:
+        ViewController.parse_range(request(range=header), ETAG, 1024)
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == "bytes */1024"
+
+def test_parse_range_if_range():
+    assert ViewController.parse_range(request(range="bytes=0-9", if_range=ETAG), ETAG, 1024) == (0, 9)
+    assert ViewController.parse_range(request(range="bytes=0-9", if_range='"other"'), ETAG, 1024) is None
+
+def test_is_not_modified_etag():
+    assert ViewController.is_not_modified(request(if_none_match=ETAG), ETAG, MTIME)
+    assert ViewController.is_not_modified(request(if_none_match=f'"x", W/{ETAG}'), ETAG, MTIME)
+    assert ViewController.is_not_modified(request(if_none_match="*"), ETAG, MTIME)
+    assert not ViewController.is_not_modified(request(if_none_match='"other"'), ETAG, MTIME)
+
+def test_is_not_modified_date():
+    assert ViewController.is_not_modified(request(if_modified_since=formatdate(MTIME, usegmt=True)), ETAG, MTIME)
+    assert not ViewController.is_not_modified(request(if_modified_since=formatdate(MTIME - 60, usegmt=True)), ETAG, MTIME)
+    assert not ViewController.is_not_modified(request(if_modified_since="invalid"), ETAG, MTIME)
+
+def test_is_not_modified_prefers_etag():
+    headers = {"if_none_match": '"other"', "if_modified_since": formatdate(MTIME, usegmt=True)}
+    assert not ViewController.is_not_modified(request(**headers), ETAG, MTIME)
+
+def test_is_not_modified_without_validators():
+    assert not ViewController.is_not_modified(request(), ETAG, MTIME)
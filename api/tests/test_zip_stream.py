@@ -0,0 +1,64 @@
+import asyncio
+import io
+import os
+import zipfile
+from app.services.zip_stream import ZipStream
+
+def build(files) -> tuple:
+    async def collect():
+        return [part async for part in ZipStream.stream(files)]
+    parts = asyncio.run(collect())
+    return parts, zipfile.ZipFile(io.BytesIO(b"".join(parts)))
+
+def test_stream_round_trip(tmp_path):
+    photo = tmp_path / "a.jpg"
+    photo.write_bytes(os.urandom(300_000))
+    text = tmp_path / "b.txt"
+    text.write_bytes(b"hello\n" * 10_000)
+
+    _, archive = build([(str(photo), "photo.jpg"), (str(text), "notes.txt")])
+
+    assert archive.testzip() is None
+    assert archive.read("photo.jpg") == photo.read_bytes()
+    assert archive.read("notes.txt") == text.read_bytes()
+    assert archive.getinfo("photo.jpg").compress_type == zipfile.ZIP_STORED
+    assert archive.getinfo("notes.txt").compress_type == zipfile.ZIP_DEFLATED
+
+def test_stream_emits_data_per_block(tmp_path, monkeypatch):
+    monkeypatch.setattr(ZipStream, "chunk_size", 64 * 1024)
+    photo = tmp_path / "a.png"
+    photo.write_bytes(os.urandom(1024 * 1024))
+
+    parts, archive = build([(str(photo), "a.png")])
+
+    # Nenhuma parte acumula o arquivo inteiro
+    assert len(parts) > 10
+    assert max(len(part) for part in parts) < 128 * 1024
+    assert archive.read("a.png") == photo.read_bytes()
+
+def test_stream_renames_duplicates_and_skips_missing(tmp_path):
+    photo = tmp_path / "a.jpg"
+    photo.write_bytes(b"jpeg")
+
+    _, archive = build([
+        (str(photo), "a.jpg"),
+        (str(tmp_path / "missing.jpg"), "missing.jpg"),
+        (str(photo), "a.jpg"),
+    ])
+
+    assert archive.namelist() == ["a.jpg", "a (1).jpg"]
+
+def test_stream_uses_zip64_for_large_entries(tmp_path, monkeypatch):
+    # Limite reduzido para simular arquivos maiores que 4 GB
+    monkeypatch.setattr(zipfile, "ZIP64_LIMIT", 1000)
+    photo = tmp_path / "a.jpg"
+    photo.write_bytes(os.urandom(5000))
+
+    _, archive = build([(str(photo), "a.jpg")])
+
+    assert archive.getinfo("a.jpg").extract_version >= zipfile.ZIP64_VERSION
+    assert archive.read("a.jpg") == photo.read_bytes()
+
+def test_stream_empty():
+    _, archive = build([])
+    assert archive.namelist() == []